@@ -0,0 +1,99 @@
+import os
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import metrics
+
+# --- تنظیمات کنترل پذیرش مینت ---
+# سقف مینت‌های پذیرفته‌شده و تمام‌نشده (در صف + در حال اجرا) برای کل سرویس
+MINT_MAX_INFLIGHT = int(os.getenv("MINT_MAX_INFLIGHT", "40"))
+# اگر زمان انتظار تخمینی صف از این بیشتر شود درخواست تازه رد می‌شود
+MINT_MAX_WAIT = float(os.getenv("MINT_MAX_WAIT", "60"))
+# هر کاربر: MINT_USER_BURST مینت پشت هم، بعد یکی هر 1/MINT_USER_RATE ثانیه
+MINT_USER_RATE = float(os.getenv("MINT_USER_RATE", "0.1"))
+MINT_USER_BURST = float(os.getenv("MINT_USER_BURST", "3"))
+MINT_USER_BUCKETS = int(os.getenv("MINT_USER_BUCKETS", "10000"))
+
+
+class Rejected(Exception):
+    def __init__(self, message: str, retry_after: float, reason: str):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class UserBuckets:
+    """token bucket جدا برای هر کاربر؛ کاربرهای قدیمی از ابتدای LRU حذف می‌شوند"""
+
+    def __init__(self, rate: float = MINT_USER_RATE, burst: float = MINT_USER_BURST, size: int = MINT_USER_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self.buckets = OrderedDict()
+
+    def take(self, user_id) -> float:
+        """0 اگر توکن برداشته شد، وگرنه چند ثانیه تا توکن بعدی"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[user_id] = (tokens, now)
+        if len(self.buckets) > self.size:
+            self.buckets.popitem(last=False)
+        return wait
+
+    def refund(self, user_id):
+        """توکن درخواستی که به صف نرسید (403، 400، 503) برمی‌گردد"""
+        if user_id in self.buckets:
+            tokens, updated = self.buckets[user_id]
+            self.buckets[user_id] = (min(self.burst, tokens + 1), updated)
+
+
+class Admission:
+    """قبل از صف: ریزش بار بر اساس عمق صف، سقف سراسری و محدودیت نرخ هر کاربر"""
+
+    def __init__(self, queue, max_inflight: int = MINT_MAX_INFLIGHT, max_wait: float = MINT_MAX_WAIT):
+        self.queue = queue
+        self.max_inflight = max_inflight
+        self.max_wait = max_wait
+        self.users = UserBuckets()
+        # درخواست‌هایی که پذیرفته شده‌اند ولی هنوز (بعد از آماده‌سازی عکس) به صف نرسیده‌اند
+        self.pending = 0
+
+    def inflight(self) -> int:
+        return self.queue.inflight() + self.pending
+
+    @contextmanager
+    def admit(self, user_id):
+        self.check(user_id)
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    def check(self, user_id):
+        """اگر مینت پذیرفته نشود Rejected با Retry-After پرتاب می‌شود"""
+        wait = self.queue.estimated_wait()
+        if wait > self.max_wait:
+            self._reject("The Void is overwhelmed. Try again soon.", wait - self.max_wait, "queue_wait")
+        if self.inflight() >= self.max_inflight:
+            slot = self.queue.avg_runtime / max(1, self.queue.workers)
+            self._reject("The Void is overwhelmed. Try again soon.", slot, "inflight")
+        # سهم کاربر فقط وقتی مصرف می‌شود که سرویس جا داشته باشد
+        user_wait = self.users.take(user_id)
+        if user_wait:
+            self._reject("Too many ascensions. Let the Void breathe.", user_wait, "user_rate")
+
+    def refund(self, user_id):
+        self.users.refund(user_id)
+
+    def _reject(self, message: str, retry_after: float, reason: str):
+        metrics.mint_rejected.inc(reason=reason)
+        raise Rejected(message, retry_after, reason)
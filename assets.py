@@ -0,0 +1,124 @@
+import os
+import re
+import gzip
+import hashlib
+import logging
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات کش استاتیک ---
+PRECOMPRESS_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".json": "application/json",
+    ".svg": "image/svg+xml",
+}
+# پوسته‌ی وب‌اپ هر بار revalidate می‌شود (304 ارزان)، گواهی‌ها هیچ‌وقت
+SHELL_CACHE_CONTROL = "no-cache"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# نام گواهی‌ها هش محتوای JPEG را دارد: {plan}_{user}_{hash}[_thumb].(jpg|webp)
+HASHED_NAME = re.compile(r"_([0-9a-f]{16})(_thumb)?\.(jpg|webp)$")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _accepted(header: str) -> dict:
+    accepted = {}
+    for part in header.split(","):
+        token, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token.strip():
+            accepted[token.strip().lower()] = q
+    return accepted
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    return if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class Asset:
+    """فایل متنی که یک بار خوانده و با gzip (و brotli اگر نصب باشد) از قبل فشرده می‌شود"""
+
+    def __init__(self, path: str, media_type: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.media_type = media_type
+        self.digest = content_hash(data)
+        self.bodies = {"identity": data, "gzip": gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(data, quality=11)
+
+    def encoding(self, accept_encoding: str) -> str:
+        accepted = _accepted(accept_encoding)
+        for name in ("br", "gzip"):
+            if name in self.bodies and accepted.get(name, accepted.get("*", 0)) > 0:
+                return name
+        return "identity"
+
+    def response(self, request_headers: Headers) -> Response:
+        encoding = self.encoding(request_headers.get("accept-encoding", ""))
+        # ETag قوی جدا برای هر encoding چون بایت‌های بدنه فرق می‌کنند
+        etag = f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": SHELL_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if etag_matches(request_headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], media_type=self.media_type, headers=headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles با پوسته‌ی از قبل فشرده در حافظه و کش immutable برای گواهی‌های هش‌دار"""
+
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.assets = {}
+        for name in sorted(os.listdir(directory)):
+            media_type = PRECOMPRESS_TYPES.get(os.path.splitext(name)[1])
+            path = os.path.join(directory, name)
+            if media_type and os.path.isfile(path):
+                self.assets[name] = Asset(path, media_type)
+        logger.info(f"Precompressed {len(self.assets)} static assets (brotli {'on' if brotli else 'off'})")
+
+    def asset_response(self, name: str, request_headers: Headers):
+        asset = self.assets.get(name)
+        return asset.response(request_headers) if asset else None
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        asset = self.assets.get(path)
+        if asset is not None:
+            return asset.response(Headers(scope=scope))
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        match = HASHED_NAME.search(os.path.basename(full_path))
+        if not match:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        # نام فایل هش محتواست، پس خودش ETag قوی و پایدار است
+        response.headers["etag"] = f'"{match[1]}{match[2] or ""}.{match[3]}"'
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,92 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import hf_client
+import cert_gen
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات استخر تصاویر پایه ---
+# فقط cert_gen.create_certificate از استخر می‌خواند (مینت وب‌اپ بدون عکس قالب Pillow است)؛
+# پیش‌فرض خاموش تا بدون مصرف‌کننده سهمیه‌ی HF خرج نشود
+BASE_POOL_SIZE = int(os.getenv("BASE_POOL_SIZE", "0"))
+BASE_POOL_MAX_USES = int(os.getenv("BASE_POOL_MAX_USES", "20"))
+BASE_POOL_TTL = float(os.getenv("BASE_POOL_TTL", "21600"))
+BASE_POOL_REFILL_INTERVAL = float(os.getenv("BASE_POOL_REFILL_INTERVAL", "30"))
+
+# هر گروه سبک یک مجموعه‌ی یکتا از پرامپت‌هاست؛ لول‌هایی که لیست یکسان دارند
+# (مثل Eternal و Divine) یک استخر مشترک می‌گیرند و دو بار گرم نمی‌شوند
+_groups = {}
+_pools = {}
+_task = None
+
+
+def style_group(level: str) -> tuple:
+    if level not in _groups:
+        styles = cert_gen.PROMPT_BANK.get(level, cert_gen.PROMPT_BANK["Eternal"])
+        _groups[level] = tuple(dict.fromkeys(styles))
+    return _groups[level]
+
+
+def _all_groups():
+    return {style_group(level) for level in cert_gen.PROMPT_BANK}
+
+
+def _alive(entry: dict) -> bool:
+    return entry["uses"] < BASE_POOL_MAX_USES and time.monotonic() - entry["created"] < BASE_POOL_TTL
+
+
+def take(level: str):
+    """یک تصویر پایه‌ی آماده برای این لول، یا None اگر استخر خالی است"""
+    pool = _pools.get(style_group(level))
+    if not pool:
+        return None
+    pool[:] = [entry for entry in pool if _alive(entry)]
+    if not pool:
+        return None
+    entry = random.choice(pool)
+    entry["uses"] += 1
+    return entry["image"]
+
+
+async def _generate(group: tuple):
+    prompt = f"{random.choice(group)}, a blank sacred stone tablet, golden glow"
+    return await hf_client.inference(cert_gen.API_URL, {"inputs": prompt})
+
+
+async def refill():
+    for group in _all_groups():
+        pool = _pools.setdefault(group, [])
+        pool[:] = [entry for entry in pool if _alive(entry)]
+        while len(pool) < BASE_POOL_SIZE:
+            image = await _generate(group)
+            if not image:
+                # HF در دسترس نیست یا breaker باز است؛ دور بعد دوباره
+                return
+            pool.append({"image": image, "created": time.monotonic(), "uses": 0})
+
+
+async def _run():
+    while True:
+        try:
+            await refill()
+        except Exception as e:
+            logger.error(f"Base pool refill failed: {e}")
+        await asyncio.sleep(BASE_POOL_REFILL_INTERVAL)
+
+
+def start():
+    global _task
+    if hf_client.HF_API_TOKEN and BASE_POOL_SIZE > 0 and _task is None:
+        _task = asyncio.create_task(_run())
+        logger.info(f"Base pool warming {len(_all_groups())} style groups x {BASE_POOL_SIZE}")
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,55 @@
+"""میکروبنچمارک رندر گواهی fallback: روش قدیمی در برابر قالب و فونت کش‌شده
+
+اجرا:  python bench/bench_render.py [تعداد]
+"""
+import io
+import os
+import sys
+import time
+import random
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import render
+
+PLANS = ["Eternal", "Divine", "Celestial", "Legendary"]
+
+
+def legacy_render_fallback(plan, burden, dna):
+    """نسخه‌ی قبلی manual_mint: هر بار همه چیز از صفر رسم می‌شود"""
+    img = Image.new('RGB', (1000, 1400), (5, 5, 5))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([50, 50, 950, 1350], outline=(212, 175, 55), width=15)
+    draw.rectangle([70, 70, 930, 1330], outline=(169, 135, 0), width=5)
+    try:
+        font = ImageFont.truetype("arial.ttf", 80)
+        font_small = ImageFont.truetype("arial.ttf", 60)
+    except:
+        font = ImageFont.load_default(size=80)
+        font_small = ImageFont.load_default(size=60)
+    draw.text((500, 200), "THE VOID", fill=(255, 215, 0), font=font, anchor="mm")
+    draw.text((500, 400), f"{plan.upper()} ASCENSION", fill=(212, 175, 55), font=font, anchor="mm")
+    draw.text((500, 700), f"Burden: {burden}", fill=(240, 240, 240), font=font_small, anchor="mm")
+    draw.text((500, 900), f"DNA: {dna}", fill=(169, 135, 0), font=font_small, anchor="mm")
+    draw.text((500, 1100), "Forever consumed by The Void", fill=(100, 100, 100), font=font_small, anchor="mm")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def bench(name, fn, n):
+    random.seed(7)
+    fn(PLANS[0], "warmup", 1234567)
+    start = time.perf_counter()
+    for i in range(n):
+        fn(PLANS[i % len(PLANS)], f"burden #{i}", random.randint(1000000, 9999999))
+    per_cert = (time.perf_counter() - start) / n * 1000
+    print(f"{name:<10} {per_cert:8.2f} ms/certificate")
+    return per_cert
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    before = bench("before", legacy_render_fallback, n)
+    after = bench("after", render.render_fallback, n)
+    print(f"speedup    {before / after:8.2f}x")
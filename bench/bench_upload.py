@@ -0,0 +1,98 @@
+"""بنچمارک حافظه‌ی آپلود عکس: base64 داخل JSON در برابر multipart جریانی
+
+هر دو مسیر از بدنه‌ی درخواست تا payload نهایی HF اندازه‌گیری می‌شوند.
+tracemalloc فقط حافظه‌ی پایتون را می‌شمارد؛ بافرهای داخلی Pillow حساب نمی‌شوند.
+
+اجرا:  python bench/bench_upload.py [عرض عکس]
+"""
+import io
+import os
+import sys
+import json
+import base64
+import hashlib
+import asyncio
+import tracemalloc
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import render
+import uploads
+
+CHUNK = 64 * 1024
+BOUNDARY = "----voidbench"
+
+
+class StreamRequest:
+    """شبیه‌ساز Request استارلت که بدنه را تکه تکه تحویل می‌دهد"""
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.headers = {"content-type": content_type, "content-length": str(len(body))}
+
+    async def stream(self):
+        for i in range(0, len(self.body), CHUNK):
+            yield self.body[i:i + CHUNK]
+
+
+def sample_photo(width: int) -> bytes:
+    image = Image.frombytes("RGB", (width, width * 4 // 3), os.urandom(width * width * 4))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def json_body(photo: bytes) -> bytes:
+    data_url = "data:image/jpeg;base64," + base64.b64encode(photo).decode()
+    return json.dumps({"u": 42, "plan": "divine", "b": "fear", "p": data_url}).encode()
+
+
+def multipart_body(photo: bytes) -> bytes:
+    parts = []
+    for name, value in (("u", "42"), ("plan", "divine"), ("b", "fear")):
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="photo"; filename="me.jpg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode() + photo + b"\r\n")
+    parts.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts)
+
+
+def hf_payload(photo: bytes) -> bytes:
+    return json.dumps({"inputs": "prompt", "init_image": base64.b64encode(photo).decode()}).encode()
+
+
+async def legacy_path(body: bytes):
+    # قبلی: request.json() روی کل بدنه، رشته‌ی base64 دست‌نخورده تا HF می‌رفت
+    request = StreamRequest(body, "application/json")
+    raw = b"".join([chunk async for chunk in request.stream()])
+    data = json.loads(raw)
+    return len(json.dumps({"inputs": "prompt", "init_image": data["p"]}).encode())
+
+
+async def streaming_path(body: bytes):
+    # همان مراحل api_mint_upload: فرم جریانی (همراه با هش عکس)، کلید idempotency (mint_key) و
+    # prepare_photo روی مسیر فایل موقت؛ اینجا بدون process pool تا حافظه‌اش هم شمرده شود
+    request = StreamRequest(body, f"multipart/form-data; boundary={BOUNDARY}")
+    fields, upload = await uploads.read_mint_form(request)
+    with upload:
+        digest = hashlib.sha256(f"{fields['u']}|{fields['plan']}|{fields['b']}|".encode())
+        digest.update((await upload.digest()).encode())
+        photo = render.prepare_photo(upload.source())
+    return len(hf_payload(photo))
+
+
+def measure(name, coro_fn, body):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    payload_size = asyncio.run(coro_fn(body))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} wire {len(body) / 1024:9.1f} KB   peak {peak / 1024:9.1f} KB   HF payload {payload_size / 1024:9.1f} KB")
+
+
+if __name__ == "__main__":
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 2400
+    photo = sample_photo(width)
+    print(f"photo {width}x{width * 4 // 3} JPEG, {len(photo) / 1024:.1f} KB")
+    measure("json", legacy_path, json_body(photo))
+    measure("multipart", streaming_path, multipart_body(photo))
@@ -0,0 +1,232 @@
+"""تست بار آفلاین: اپ FastAPI در برابر stubهای محلی Bot API تلگرام و Hugging Face
+
+هیچ درخواستی به اینترنت نمی‌رود. برای هر endpoint توان عملیاتی و تاخیر p50/p95/p99 گزارش می‌شود.
+
+اجرا:
+    python bench/loadtest.py --requests 200 --concurrency 20 --hf-latency 2 --hf-fail 0.1
+"""
+import io
+import os
+import sys
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+from aiohttp import web, ClientSession, FormData
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "123456:LOADTEST"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def jpeg(width: int, height: int, color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+# --- stub تلگرام ---
+def telegram_stub(latency: float, fail: float) -> web.Application:
+    counter = {"message_id": 0}
+
+    def message(chat_id, **extra):
+        counter["message_id"] += 1
+        return {"message_id": counter["message_id"], "date": int(time.time()),
+                "chat": {"id": int(chat_id or 1), "type": "private"}, **extra}
+
+    async def handle(request):
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        await asyncio.sleep(random.expovariate(1 / latency) if latency else 0)
+        if fail and random.random() < fail:
+            return web.json_response({"ok": False, "error_code": 500, "description": "Injected failure"})
+        chat_id = form.get("chat_id")
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Void", "username": "void_loadtest_bot"}
+        elif method == "sendphoto":
+            n = counter["message_id"]
+            result = message(chat_id, photo=[{"file_id": f"photo{n}", "file_unique_id": f"u{n}", "width": 1000, "height": 1400}])
+        elif method in ("sendmessage", "forwardmessage", "editmessagetext", "copymessage"):
+            result = message(chat_id, text=form.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+# --- stub Hugging Face ---
+def hf_stub(latency: float, fail: float) -> web.Application:
+    image = jpeg(512, 512, (40, 10, 70))
+
+    async def handle(request):
+        await request.read()
+        await asyncio.sleep(random.expovariate(1 / latency) if latency else 0)
+        if fail and random.random() < fail:
+            return web.json_response({"error": "Model is loading", "estimated_time": 0.1}, status=503)
+        return web.Response(body=image, content_type="image/jpeg")
+
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app.router.add_post("/models/{model:.*}", handle)
+    return app
+
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+# --- اندازه‌گیری ---
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.spans = {}
+
+    def add(self, name: str, seconds: float, ok: bool):
+        self.samples.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, label: str = "endpoint"):
+        print(f"\n{label:<22}{'n':>6}{'err':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, values in self.samples.items():
+            values = sorted(values)
+            pct = lambda p: values[min(len(values) - 1, int(p * len(values)))] * 1000
+            rate = len(values) / self.spans.get(name, 1)
+            print(f"{name:<22}{len(values):>6}{self.errors.get(name, 0):>6}{rate:>9.1f}"
+                  f"{pct(0.50):>10.1f}{pct(0.95):>10.1f}{pct(0.99):>10.1f}")
+
+
+async def drive(recorder: Recorder, name: str, total: int, concurrency: int, call):
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            recorder.add(name, time.perf_counter() - start, ok)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    recorder.spans[name] = time.perf_counter() - start
+
+
+def start_update(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"Soul{user_id}"},
+        "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}
+
+
+async def run(args):
+    tg_port, hf_port, app_port = free_port(), free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="void-loadtest-")
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{tg_port}",
+        "HF_API_TOKEN": "loadtest",
+        "HF_API_BASE": f"http://127.0.0.1:{hf_port}",
+        "HF_BACKOFF_BASE": "0.1",
+        "WEBAPP_URL": f"http://127.0.0.1:{app_port}",
+        "DB_PATH": os.path.join(workdir, "void_data.db"),
+        "STORAGE_DIR": os.path.join(workdir, "outputs"),
+    })
+    runners = [await serve(telegram_stub(args.tg_latency, args.tg_fail), tg_port),
+               await serve(hf_stub(args.hf_latency, args.hf_fail), hf_port)]
+
+    sys.path.insert(0, ROOT)
+    import uvicorn
+    import main
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=app_port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base = f"http://127.0.0.1:{app_port}"
+    photo = jpeg(1600, 2000, (120, 90, 30))
+    users = [100000 + i for i in range(args.users)]
+    recorder = Recorder()
+    update_ids = iter(range(1, 10 ** 9))
+
+    async with ClientSession() as http:
+        async def webhook(i):
+            async with http.post(f"{base}/webhook", json=start_update(next(update_ids), users[i % len(users)])) as r:
+                return r.status == 200
+
+        async def mint(i):
+            user_id = users[i % len(users)]
+            plan = random.choice(["divine", "celestial", "legendary"])
+            with_photo = random.random() < args.photo_ratio
+            start = time.perf_counter()
+            if with_photo:
+                form = FormData()
+                form.add_field("u", str(user_id))
+                form.add_field("plan", plan)
+                form.add_field("b", f"burden {i}")
+                form.add_field("photo", photo, filename="me.jpg", content_type="image/jpeg")
+                request = http.post(f"{base}/api/mint/upload", data=form)
+            else:
+                request = http.post(f"{base}/api/mint", json={"u": user_id, "plan": plan, "b": f"burden {i}"})
+            async with request as r:
+                body = await r.json()
+            recorder.add("POST /api/mint accept", time.perf_counter() - start, r.status == 202)
+            if r.status != 202:
+                return False
+            # زمان کامل مینت تا success با polling وضعیت
+            while True:
+                async with http.get(f"{base}{body['status_url']}") as r:
+                    status = await r.json()
+                if status.get("status") not in ("queued", "running"):
+                    return status.get("status") == "success"
+                await asyncio.sleep(0.1)
+
+        async def gallery(i):
+            async with http.get(f"{base}/api/gallery/{users[i % len(users)]}?limit=30") as r:
+                await r.read()
+                return r.status == 200
+
+        await drive(recorder, "POST /webhook", args.requests, args.concurrency, webhook)
+        await drive(recorder, "mint end-to-end", args.requests, args.concurrency, mint)
+        await drive(recorder, "GET /api/gallery", args.requests, args.concurrency, gallery)
+
+    recorder.report()
+
+    server.should_exit = True
+    await server_task
+    for runner in runners:
+        await runner.cleanup()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--photo-ratio", type=float, default=0.3, help="share of mints that upload a photo")
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="mean Bot API latency (s)")
+    parser.add_argument("--tg-fail", type=float, default=0.0, help="Bot API failure probability")
+    parser.add_argument("--hf-latency", type=float, default=1.0, help="mean HF inference latency (s)")
+    parser.add_argument("--hf-fail", type=float, default=0.0, help="HF 503 probability")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""بازپخش آپدیت‌های ضبط‌شده‌ی وبهوک در Dispatcher، در برابر stub محلی Bot API
+
+ضبط: سرور با UPDATE_CAPTURE_PATH=updates.jsonl اجرا شود. هر خط یا {"received": ..., "update": {...}}
+است یا خود آپدیت خام؛ خط‌های بدون update_id رد می‌شوند. توان عملیاتی و تاخیر p50/p95/p99
+هر handler (cmd_start، callbackهای ادمین، مراحل FSM) گزارش می‌شود.
+
+اجرا:
+    python bench/replay.py updates.jsonl                  # با حداکثر سرعت
+    python bench/replay.py updates.jsonl --speed 1        # با فاصله‌ی زمانی ضبط‌شده
+    python bench/replay.py updates.jsonl --admin-id 12345 # آپدیت‌های ادمین مسیر پنل را طی کنند
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from loadtest import BOT_TOKEN, ROOT, free_port, telegram_stub, hf_stub, serve, Recorder
+
+
+def load_updates(path: str):
+    """(زمان دریافت یا None، آپدیت خام) به ترتیب فایل"""
+    updates, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += line.strip() != ""
+                continue
+            if isinstance(record, dict) and isinstance(record.get("update"), dict):
+                received, record = record.get("received"), record["update"]
+            else:
+                received = None
+            if not isinstance(record, dict) or "update_id" not in record:
+                skipped += 1
+                continue
+            updates.append((received, record))
+    return updates, skipped
+
+
+async def run(args):
+    updates, skipped = load_updates(args.path)
+    print(f"{len(updates)} updates loaded, {skipped} lines skipped")
+    if not updates:
+        return
+
+    tg_port, hf_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="void-replay-")
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{tg_port}",
+        "HF_API_TOKEN": "replay",
+        "HF_API_BASE": f"http://127.0.0.1:{hf_port}",
+        "WEBAPP_URL": "http://127.0.0.1",
+        "DB_PATH": os.path.join(workdir, "void_data.db"),
+        "STORAGE_DIR": os.path.join(workdir, "outputs"),
+        "UPDATE_CAPTURE_PATH": "",
+    })
+    if args.admin_id:
+        os.environ["ADMIN_ID"] = str(args.admin_id)
+    runners = [await serve(telegram_stub(args.tg_latency, 0), tg_port),
+               await serve(hf_stub(args.hf_latency, 0), hf_port)]
+
+    sys.path.insert(0, ROOT)
+    from aiogram import types
+    import main
+
+    recorder = Recorder()
+    main.handler_timer.on_timed = recorder.add
+    async with main.app.router.lifespan_context(main.app):
+        # همان مسیر وبهوک: UpdatePool ترتیب هر چت را حفظ می‌کند تا مراحل FSM درست پیش بروند
+        first = next((received for received, _ in updates if received is not None), None)
+        start = time.perf_counter()
+        for received, raw in updates:
+            if args.speed > 0 and received is not None and first is not None:
+                delay = (received - first) / args.speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await main.update_pool.submit(types.Update(**raw))
+        await asyncio.gather(*(queue.join() for queue in main.update_pool.queues))
+        elapsed = time.perf_counter() - start
+        # مینت‌های ادمین هم در صف مینت اجرا می‌شوند و تا پایان صبر داده می‌شوند
+        await main.mint_queue.queue.join()
+
+    for name in recorder.samples:
+        recorder.spans[name] = elapsed
+    print(f"{len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.1f} updates/s)")
+    recorder.report("handler")
+
+    for runner in runners:
+        await runner.cleanup()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default="updates.jsonl", help="captured JSONL file")
+    parser.add_argument("--speed", type=float, default=0, help="0 = as fast as possible, 1 = recorded pacing, 2 = twice as fast")
+    parser.add_argument("--admin-id", type=int, default=0, help="treat this Telegram id as ADMIN_ID")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="mean Bot API latency (s)")
+    parser.add_argument("--hf-latency", type=float, default=0.0, help="mean HF inference latency (s)")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import logging
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+import leader
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات پیام همگانی ---
+# تلگرام حدود ۳۰ پیام در ثانیه برای کل بات اجازه می‌دهد
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", "200"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+# رهبر هر این‌قدر پیام‌های همگانی workerهای مرده را برمی‌دارد
+BROADCAST_RESUME_INTERVAL = float(os.getenv("BROADCAST_RESUME_INTERVAL", "30"))
+
+
+class TokenBucket:
+    """محدودکننده‌ی نرخ؛ با RetryAfter همه‌ی ارسال‌ها تا پایان مهلت متوقف می‌شوند"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.updated = self.paused_until
+        self.tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+bucket = TokenBucket(BROADCAST_RATE)
+_tasks = set()
+
+
+def start(bot, broadcast_id: int):
+    """اجرای پیام همگانی در پس‌زمینه تا هندلر ادمین فوراً برگردد"""
+    task = asyncio.create_task(run(bot, broadcast_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def resume_all(bot):
+    """پیام‌هایی که مالکشان دیگر ضربان نمی‌زند؛ پیام worker زنده همان‌جا ادامه دارد و دوباره فرستاده نمی‌شود"""
+    for broadcast_id in await db.claim_orphaned_broadcasts(leader.PROCESS_ID, leader.alive_after()):
+        logger.info(f"Resuming broadcast #{broadcast_id}")
+        start(bot, broadcast_id)
+
+
+def watch(bot):
+    """resume_all در پس‌زمینه؛ worker دیگری که وسط کار بمیرد بعد از HEARTBEAT_TIMEOUT جانشین پیدا می‌کند"""
+    task = asyncio.create_task(_watch(bot))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def _watch(bot):
+    while True:
+        try:
+            await resume_all(bot)
+        except Exception as e:
+            logger.error(f"Broadcast resume failed: {e}")
+        await asyncio.sleep(BROADCAST_RESUME_INTERVAL)
+
+
+async def stop():
+    # وضعیت running در دیتابیس می‌ماند؛ با حذف ضربان این پروسه رهبر بعدی فوراً ادامه‌اش می‌دهد
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+
+
+async def _deliver(bot, bc: dict, user_id: int) -> str:
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        await bucket.acquire()
+        try:
+            await bot.forward_message(chat_id=user_id, from_chat_id=bc["from_chat_id"], message_id=bc["message_id"])
+            return "sent"
+        except TelegramRetryAfter as e:
+            logger.warning(f"Broadcast #{bc['id']} flood limit, retry after {e.retry_after}s")
+            bucket.pause(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest):
+            return "failed"
+        except Exception as e:
+            logger.error(f"Broadcast #{bc['id']} to {user_id} failed: {e}")
+            return "failed"
+    return "failed"
+
+
+async def _report(bot, bc: dict, started: float, delivered: int, done: bool = False):
+    rate = delivered / max(time.monotonic() - started, 0.001)
+    head = "📢 Broadcast complete" if done else "📢 Broadcasting..."
+    text = (f"{head} #{bc['id']}\n\n"
+            f"✅ Sent: {bc['sent']:,}\n"
+            f"⚠️ Failed: {bc['failed']:,}\n"
+            f"👥 Progress: {bc['sent'] + bc['failed']:,}/{bc['total']:,}\n"
+            f"⚡ {rate:.1f} msg/s")
+    try:
+        await bot.edit_message_text(text, chat_id=bc["status_chat_id"], message_id=bc["status_message_id"])
+    except Exception as e:
+        logger.warning(f"Broadcast #{bc['id']} progress update failed: {e}")
+
+
+async def run(bot, broadcast_id: int):
+    bc = await db.get_broadcast(broadcast_id)
+    if not bc or bc["status"] != "running":
+        return
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    started = last_report = time.monotonic()
+    delivered = 0
+
+    async def send_one(user_id):
+        async with semaphore:
+            status = await _deliver(bot, bc, user_id)
+        # هر گیرنده بلافاصله ثبت می‌شود تا بعد از crash دوباره پیام نگیرد
+        await db.record_delivery(broadcast_id, user_id, status)
+        return status
+
+    while True:
+        # گیرنده‌ها دسته به دسته از دیتابیس خوانده می‌شوند، نه همه با هم
+        user_ids = await db.broadcast_recipients(broadcast_id, bc["last_user_id"], BROADCAST_CHUNK)
+        if not user_ids:
+            break
+        results = await asyncio.gather(*(send_one(uid) for uid in user_ids))
+        if not await db.advance_broadcast(broadcast_id, user_ids[-1], leader.PROCESS_ID):
+            # ضربان این پروسه قطع شده بود و پروسه‌ی دیگری پیام را برداشته است
+            logger.warning(f"Broadcast #{broadcast_id} taken over by another worker, stopping here")
+            return
+
+        sent = results.count("sent")
+        bc["sent"] += sent
+        bc["failed"] += len(results) - sent
+        bc["last_user_id"] = user_ids[-1]
+        delivered += len(results)
+        if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+            await _report(bot, bc, started, delivered)
+            last_report = time.monotonic()
+
+    await db.finish_broadcast(broadcast_id)
+    await _report(bot, bc, started, delivered, done=True)
+    logger.info(f"Broadcast #{broadcast_id} done: {bc['sent']} sent, {bc['failed']} failed")
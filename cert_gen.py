@@ -1,15 +1,14 @@
-import os
 import random
-import requests
-import io
 import hashlib
-from PIL import Image, ImageDraw, ImageFont
 from datetime import datetime
+import hf_client
+import render
+import base_pool
+import storage
+import db
 
 # --- تنظیمات هوش مصنوعی ---
-HF_TOKEN = os.getenv("HF_API_TOKEN")
-API_URL = "https://api-inference.huggingface.co/models/runwayml/stable-diffusion-v1-5"
-headers = {"Authorization": f"Bearer {HF_TOKEN}"}
+API_URL = f"{hf_client.HF_API_BASE}/models/runwayml/stable-diffusion-v1-5"
 
 # --- بانک ۱۵۰ سبک بر اساس نایابی (فهرست کامل) ---
 # توجه: من ساختار را برای شما چیده ام، شما فقط متن پرامپت ها را در لیست ها کپی کنید.
@@ -197,7 +196,7 @@ def generate_dna(user_id, level):
     seed = f"{user_id}{level}{datetime.now()}".encode()
     return hashlib.sha256(seed).hexdigest()[:10].upper()
 
-def create_certificate(user_id, burden, level="Eternal", user_photo_path=None):
+async def create_certificate(user_id, burden, level="Eternal", user_photo_path=None):
     """تولید خروجی نهایی گواهینامه"""
     
     # انتخاب تصادفی یک سبک از بین ۱۵۰ سبک بر اساس لول تعیین شده
@@ -207,37 +206,17 @@ def create_certificate(user_id, burden, level="Eternal", user_photo_path=None):
     # ترکیب فداکاری کاربر با پرامپت هنری
     final_prompt = f"{base_prompt}, a sacred stone tablet inscribed with '{burden}', golden glow"
 
-    try:
-        # فراخوانی هوش مصنوعی
-        response = requests.post(API_URL, headers=headers, json={"inputs": final_prompt})
-        image = Image.open(io.BytesIO(response.content))
-    except:
-        # تصویر رزرو در صورت قطع بودن اینترنت
-        image = Image.new('RGB', (1000, 1414), color='#0a0a0a')
-
-    # پردازش گرافیکی
-    canvas = image.resize((1000, 1414))
-    draw = ImageDraw.Draw(canvas)
+    # تصویر پایه‌ی آماده از استخر؛ فقط اگر خالی باشد هوش مصنوعی فراخوانی می‌شود
+    content = base_pool.take(level)
+    if content is None:
+        content = await hf_client.inference(API_URL, {"inputs": final_prompt})
     dna = generate_dna(user_id, level)
 
-    # لود کردن فونت (مطمئن شوید فایل فونت کنار کد است)
-    try:
-        font_main = ImageFont.truetype("cinzel.ttf", 55)
-        font_sub = ImageFont.truetype("cinzel.ttf", 30)
-    except:
-        font_main = ImageFont.load_default()
-        font_sub = ImageFont.load_default()
-
-    # درج اطلاعات بر روی عکس
-    draw.text((500, 150), "CERTIFICATE OF ASCENSION", fill="#D4AF37", font=font_main, anchor="mm")
-    draw.text((500, 700), f"'{burden}'", fill="white", font=font_sub, anchor="mm")
-    draw.text((500, 1250), f"DNA: {dna} | LEVEL: {level}", fill="#D4AF37", font=font_sub, anchor="mm")
+    # پردازش گرافیکی در process pool
+    png_bytes = await render.run(render.render_certificate, content, burden, level, dna)
 
-    # ذخیره در پوشه خروجی برای نمایش در وب‌اپ
-    if not os.path.exists("static/outputs"):
-        os.makedirs("static/outputs")
-        
-    path = f"static/outputs/{dna}.png"
-    canvas.save(path)
+    # ذخیره در storage (پوشه‌ی شارد یا S3) برای نمایش در وب‌اپ
+    key, url = await storage.save(f"{dna}.png", png_bytes, "image/png")
+    await db.index_files([(key, len(png_bytes))])
     
-    return path, dna
+    return url, dna
@@ -0,0 +1,848 @@
+import os
+import sys
+import queue
+import base64
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات دیتابیس ---
+DB_PATH = os.getenv("DB_PATH", "void_data.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# NORMAL: در WAL فقط checkpointها fsync می‌شوند (قطع برق ممکن است آخرین commitها را ببرد)؛
+# FULL: هر commit یک fsync، که group commit بین همه‌ی نوشتن‌های آن دسته تقسیم می‌کند
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+# commit: await نوشتن بعد از commit برمی‌گردد؛ write-behind: بعد از اجرا در تراکنش باز،
+# و commit تا پایان پنجره عقب می‌افتد (crash آخرین پنجره را می‌برد، خواننده‌ها تا commit نمی‌بینند)
+DB_DURABILITY = os.getenv("DB_DURABILITY", "commit")
+# هر commit حداکثر این‌قدر برای نوشتن‌های بعدی صبر می‌کند و حداکثر این تعداد را با هم ثبت می‌کند
+DB_COMMIT_WINDOW = float(os.getenv("DB_COMMIT_WINDOW", "0.002"))
+DB_COMMIT_BATCH = int(os.getenv("DB_COMMIT_BATCH", "64"))
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA synchronous = {DB_SYNCHRONOUS}",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+# یک thread نویسنده (SQLite در هر لحظه فقط یک writer دارد) و چند thread خواننده؛
+# هر thread اتصال ماندگار خودش را دارد و statementها در کش همان اتصال می‌مانند
+_writer = None
+_readers = None
+_local = threading.local()
+
+
+def _executors():
+    global _writer, _readers
+    if _writer is None:
+        _writer = GroupWriter()
+        _readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+    return _writer, _readers
+
+
+def connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, cached_statements=256)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+
+def _query_name(fn) -> str:
+    # برای lambdaها نام تابع async صدازننده (مثلاً get_ascension) در متریک ثبت می‌شود
+    if fn.__name__ == "<lambda>":
+        return sys._getframe(2).f_code.co_name
+    return fn.__name__
+
+
+def _call(fn, args, query, mode):
+    start = time.perf_counter()
+    try:
+        return fn(_conn(), *args)
+    finally:
+        metrics.db_query_seconds.observe(time.perf_counter() - start, query=query, mode=mode)
+
+
+async def read(fn, *args):
+    """اجرای fn(conn, *args) روی یکی از threadهای خواننده"""
+    return await asyncio.get_running_loop().run_in_executor(_executors()[1], _call, fn, args, _query_name(fn), "read")
+
+
+async def write(fn, *args, on_commit=None):
+    """اجرای fn(conn, *args) روی thread نویسنده؛ اگر خطا بدهد فقط تغییرات خودش برمی‌گردد
+
+    on_commit بعد از commit واقعی روی event loop صدا زده می‌شود، حتی در حالت write-behind که
+    خود await زودتر برمی‌گردد؛ جای درست برای باطل کردن کش‌هایی که از دیتابیس پر می‌شوند.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _executors()[0].submit((fn, args, _query_name(fn), loop, future, on_commit))
+    return await future
+
+
+def _resolve(loop, future, result=None, error=None):
+    def settle():
+        # صدازننده ممکن است cancel شده باشد
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    loop.call_soon_threadsafe(settle)
+
+
+class GroupWriter:
+    """thread نویسنده با group commit
+
+    نوشتن‌هایی که در پنجره‌ی DB_COMMIT_WINDOW (یا پشت commit قبلی) صف شده‌اند در یک تراکنش
+    اجرا می‌شوند، هر کدام در SAVEPOINT خودش، و همه با یک commit (و یک fsync) ثبت می‌شوند.
+    """
+
+    def __init__(self, window: float = DB_COMMIT_WINDOW, batch: int = DB_COMMIT_BATCH,
+                 durability: str = DB_DURABILITY):
+        self.window = window
+        self.batch = batch
+        self.durability = durability
+        self.queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        self.queue.put(item)
+
+    def shutdown(self):
+        # نوشتن‌های صف‌شده قبل از بسته شدن commit می‌شوند
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = _local.conn = connect()
+        conn.isolation_level = None
+        try:
+            while True:
+                batch, stop = self._collect()
+                if batch:
+                    self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _collect(self):
+        item = self.queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        # نوشتن تنها منتظر نمی‌ماند؛ پنجره فقط وقتی باز می‌شود که نوشتن‌های دیگری پشت سرش باشند
+        if self.queue.empty():
+            return batch, False
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception as e:
+            for _, _, _, loop, future, _ in batch:
+                _resolve(loop, future, error=e)
+            return
+        done, callbacks = [], []
+        for fn, args, query, loop, future, on_commit in batch:
+            conn.execute("SAVEPOINT item")
+            try:
+                result = _call(fn, args, query, "write")
+                conn.execute("RELEASE item")
+            except Exception as e:
+                conn.execute("ROLLBACK TO item")
+                conn.execute("RELEASE item")
+                _resolve(loop, future, error=e)
+                continue
+            if on_commit is not None:
+                callbacks.append((loop, on_commit))
+            if self.durability == "write-behind":
+                _resolve(loop, future, result)
+            else:
+                done.append((loop, future, result))
+        try:
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for loop, future, _ in done:
+                _resolve(loop, future, error=e)
+            return
+        # اول callbackها، بعد جواب‌ها: کدی که بعد از await ادامه می‌دهد کش باطل‌شده را می‌بیند
+        for loop, on_commit in callbacks:
+            loop.call_soon_threadsafe(on_commit)
+        for loop, future, result in done:
+            _resolve(loop, future, result)
+        metrics.db_commit_seconds.observe(time.perf_counter() - start)
+        metrics.db_commit_batch.observe(len(batch))
+
+
+def close():
+    global _writer, _readers
+    if _writer is not None:
+        _writer.shutdown()
+        _readers.shutdown(wait=True)
+        _writer = _readers = None
+
+
+# --- اسکیما ---
+# هر مهاجرت فقط یک بار اجرا می‌شود؛ شماره‌ی آخرین مهاجرت در PRAGMA user_version است
+MIGRATIONS = [
+    # 1: ایندکس گالری کاربر و آخرین عروج‌ها
+    (
+        "CREATE INDEX IF NOT EXISTS idx_ascensions_user_ts ON ascensions (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_ascensions_ts ON ascensions (timestamp)",
+    ),
+    # 2: جدول شمارنده‌های پنل ادمین و پر کردن اولیه‌ی آن از داده‌های موجود
+    (
+        "CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR REPLACE INTO stats SELECT 'users', COUNT(*) FROM users",
+        "INSERT OR REPLACE INTO stats SELECT 'free_mints', COALESCE(SUM(free_mints), 0) FROM users",
+        "INSERT OR REPLACE INTO stats SELECT 'ascensions', COUNT(*) FROM ascensions",
+        "INSERT OR REPLACE INTO stats SELECT 'plan:' || plan, COUNT(*) FROM ascensions GROUP BY plan",
+        "INSERT OR REPLACE INTO stats SELECT 'day:' || date(timestamp), COUNT(*) FROM ascensions GROUP BY date(timestamp)",
+    ),
+    # 3: پیشرفت ماندگار پیام همگانی برای ادامه بعد از ری‌استارت
+    (
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               from_chat_id INTEGER,
+               message_id INTEGER,
+               status_chat_id INTEGER,
+               status_message_id INTEGER,
+               status TEXT DEFAULT 'running',
+               total INTEGER DEFAULT 0,
+               sent INTEGER DEFAULT 0,
+               failed INTEGER DEFAULT 0,
+               last_user_id INTEGER DEFAULT 0,
+               created DATETIME DEFAULT CURRENT_TIMESTAMP,
+               finished DATETIME
+           )""",
+        """CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+               broadcast_id INTEGER,
+               user_id INTEGER,
+               status TEXT,
+               PRIMARY KEY (broadcast_id, user_id)
+           ) WITHOUT ROWID""",
+    ),
+    # 4: نسخه‌های سبک تصویر برای گالری
+    (
+        "ALTER TABLE ascensions ADD COLUMN thumb_url TEXT",
+        "ALTER TABLE ascensions ADD COLUMN webp_url TEXT",
+    ),
+    # 5: file_id تلگرام تا گواهی فقط یک بار آپلود شود
+    (
+        "ALTER TABLE ascensions ADD COLUMN file_id TEXT",
+    ),
+    # 6: فهرست اندازه و سن فایل‌های خروجی برای نگهداری و سهمیه
+    (
+        """CREATE TABLE IF NOT EXISTS files (
+               key TEXT PRIMARY KEY,
+               ascension_id INTEGER,
+               size INTEGER NOT NULL,
+               created REAL NOT NULL
+           ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_files_created ON files (created)",
+        "CREATE INDEX IF NOT EXISTS idx_files_ascension ON files (ascension_id)",
+    ),
+    # 7: حالت FSM و کارهای مینت مشترک بین چند worker
+    (
+        """CREATE TABLE IF NOT EXISTS fsm (
+               key TEXT PRIMARY KEY,
+               state TEXT,
+               data TEXT
+           ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS mint_jobs (
+               id TEXT PRIMARY KEY,
+               key TEXT,
+               status TEXT NOT NULL,
+               result TEXT,
+               error TEXT,
+               created REAL NOT NULL,
+               finished REAL
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_mint_jobs_key ON mint_jobs (key)",
+        "CREATE INDEX IF NOT EXISTS idx_mint_jobs_created ON mint_jobs (created)",
+    ),
+    # 8: زمان ثبت‌نام کاربر برای گرم کردن کش با تازه‌ترین‌ها (کاربرهای قدیمی NULL می‌مانند)
+    (
+        "ALTER TABLE users ADD COLUMN created REAL",
+        "CREATE INDEX IF NOT EXISTS idx_users_created ON users (created)",
+    ),
+    # 9: ضربان پروسه‌ها و مالک کارهای مینت تا کار پروسه‌ی مرده یتیم شناخته شود
+    (
+        """CREATE TABLE IF NOT EXISTS processes (
+               id TEXT PRIMARY KEY,
+               heartbeat REAL NOT NULL
+           ) WITHOUT ROWID""",
+        "ALTER TABLE mint_jobs ADD COLUMN owner TEXT",
+    ),
+    # 10: کاربری که اگر کار مینت شکست بخورد مینت رایگانش برمی‌گردد
+    (
+        "ALTER TABLE mint_jobs ADD COLUMN refund_user INTEGER",
+    ),
+    # 11: پروسه‌ای که پیام همگانی را می‌فرستد؛ فقط پیام مالک مرده ادامه داده می‌شود
+    (
+        "ALTER TABLE broadcasts ADD COLUMN owner TEXT",
+    ),
+    # 12: هر کلید idempotency حداکثر یک کار زنده (نه failed) در کل workerها
+    (
+        "UPDATE mint_jobs SET key = NULL WHERE key IS NOT NULL AND status != 'failed' AND rowid NOT IN "
+        "(SELECT MAX(rowid) FROM mint_jobs WHERE key IS NOT NULL AND status != 'failed' GROUP BY key)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_mint_jobs_live_key ON mint_jobs (key) WHERE status != 'failed'",
+    ),
+]
+
+
+def migrate(conn):
+    """باید داخل تراکنش init_db صدا زده شود"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for sql in statements:
+            conn.execute(sql)
+        conn.execute(f"PRAGMA user_version = {number}")
+        logger.info(f"DB migrated to version {number}")
+
+
+def init_db():
+    """ساخت جدول‌ها و اجرای مهاجرت‌ها
+
+    همه در یک تراکنش BEGIN IMMEDIATE؛ اگر چند worker هم‌زمان بالا بیایند یکی مهاجرت می‌کند
+    و بقیه پشت قفل می‌مانند و بعد user_version به‌روز را می‌بینند.
+    """
+    conn = connect()
+    conn.isolation_level = None
+    conn.execute("PRAGMA busy_timeout = 60000")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _create_schema(conn)
+        migrate(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _create_schema(conn):
+    c = conn.cursor()
+    c.execute("""CREATE TABLE IF NOT EXISTS users (
+                 id INTEGER PRIMARY KEY,
+                 username TEXT,
+                 refs INTEGER DEFAULT 0,
+                 free_mints INTEGER DEFAULT 3,
+                 total_ascensions INTEGER DEFAULT 0
+              )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS ascensions (
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 user_id INTEGER,
+                 plan TEXT,
+                 burden TEXT,
+                 dna INTEGER,
+                 image_url TEXT,
+                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+              )""")
+
+
+# --- شمارنده‌ها ---
+# هر نوشتن شمارنده‌های مربوطه را در همان تراکنش به‌روز می‌کند تا پنل ادمین فقط چند سطر بخواند
+FREE_MINTS_DEFAULT = 3
+
+
+def _bump(conn, key, delta=1):
+    conn.execute("INSERT INTO stats (key, value) VALUES (?, ?) "
+                 "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value", (key, delta))
+
+
+# --- کاربران ---
+def _insert_users(conn, users):
+    # فقط سطرهایی که واقعاً اضافه شدند شمرده و به دعوت‌کننده نسبت داده می‌شوند
+    added, created = 0, time.time()
+    for user_id, username, referrer in users:
+        c = conn.execute("INSERT OR IGNORE INTO users (id, username, created) VALUES (?, ?, ?)",
+                         (user_id, username, created))
+        if c.rowcount:
+            added += 1
+            if referrer:
+                conn.execute("UPDATE users SET refs = refs + 1 WHERE id = ?", (referrer,))
+    if added:
+        _bump(conn, "users", added)
+        _bump(conn, "free_mints", FREE_MINTS_DEFAULT * added)
+    return added
+
+
+async def insert_users(users) -> int:
+    """دسته‌ی (id, username, referrer)؛ تعداد کاربرهای تازه"""
+    return await write(_insert_users, users)
+
+
+async def user_ids(limit: int):
+    """شناسه‌ی کاربرها به ترتیب ثبت‌نام، تازه‌ترین اول؛ کاربرهای قبل از ستون created آخر می‌آیند"""
+    return await read(lambda conn: [row[0] for row in conn.execute(
+        "SELECT id FROM users ORDER BY created DESC NULLS LAST LIMIT ?", (limit,))])
+
+
+def _take_free_mint(conn, user_id):
+    # بررسی و کم کردن در یک UPDATE شرطی؛ دو درخواست هم‌زمان نمی‌توانند یک مینت را دو بار بگیرند
+    c = conn.execute("UPDATE users SET free_mints = free_mints - 1 WHERE id = ? AND free_mints > 0", (user_id,))
+    if c.rowcount == 0:
+        return False
+    _bump(conn, "free_mints", -1)
+    return True
+
+
+async def take_free_mint(user_id: int) -> bool:
+    """یک مینت رایگان کم می‌کند؛ اگر نمانده باشد False"""
+    return await write(_take_free_mint, user_id)
+
+
+def _refund_free_mint(conn, user_id):
+    c = conn.execute("UPDATE users SET free_mints = free_mints + 1 WHERE id = ?", (user_id,))
+    if c.rowcount:
+        _bump(conn, "free_mints", 1)
+
+
+async def refund_free_mint(user_id: int):
+    """مینت رایگانی که گرفته شد ولی کاری برایش ثبت نشد"""
+    await write(_refund_free_mint, user_id)
+
+
+def _reset_free_mints(conn):
+    conn.execute("UPDATE users SET free_mints = ?", (FREE_MINTS_DEFAULT,))
+    conn.execute("INSERT OR REPLACE INTO stats SELECT 'free_mints', ? * COALESCE("
+                 "(SELECT value FROM stats WHERE key = 'users'), 0)", (FREE_MINTS_DEFAULT,))
+
+
+async def reset_free_mints():
+    await write(_reset_free_mints)
+
+
+async def top_users(limit: int = 10):
+    return await read(lambda conn: conn.execute(
+        "SELECT id, username, total_ascensions FROM users ORDER BY total_ascensions DESC LIMIT ?",
+        (limit,)).fetchall())
+
+
+# --- عروج‌ها ---
+def _record_ascension(conn, user_id, plan, burden, dna, image_url, thumb_url, webp_url, files):
+    c = conn.execute("INSERT INTO ascensions (user_id, plan, burden, dna, image_url, thumb_url, webp_url) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (user_id, plan, burden, dna, image_url, thumb_url, webp_url))
+    conn.execute("UPDATE users SET total_ascensions = total_ascensions + 1 WHERE id = ?", (user_id,))
+    _bump(conn, "ascensions")
+    _bump(conn, f"plan:{plan}")
+    _bump(conn, f"day:{_today(conn)}")
+    _index_files(conn, c.lastrowid, files)
+    return c.lastrowid
+
+
+def _today(conn):
+    # همان تقویم UTC که ستون timestamp با CURRENT_TIMESTAMP دارد
+    return conn.execute("SELECT date('now')").fetchone()[0]
+
+
+async def record_ascension(user_id: int, plan: str, burden: str, dna: int, image_url: str,
+                           thumb_url: str = None, webp_url: str = None, files=(), on_commit=None) -> int:
+    """files: جفت‌های (key, size) فایل‌های این گواهی که در همان تراکنش فهرست می‌شوند"""
+    return await write(_record_ascension, user_id, plan, burden, dna, image_url, thumb_url, webp_url, files,
+                       on_commit=on_commit)
+
+
+async def last_ascensions(limit: int = 20):
+    return await read(lambda conn: conn.execute(
+        "SELECT user_id, plan, burden, dna, timestamp, file_id FROM ascensions ORDER BY timestamp DESC LIMIT ?",
+        (limit,)).fetchall())
+
+
+ASCENSION_COLUMNS = ("id", "user_id", "plan", "burden", "dna", "image_url", "file_id")
+
+
+async def get_ascension(ascension_id: int):
+    row = await read(lambda conn: conn.execute(
+        f"SELECT {', '.join(ASCENSION_COLUMNS)} FROM ascensions WHERE id = ?", (ascension_id,)).fetchone())
+    return dict(zip(ASCENSION_COLUMNS, row)) if row else None
+
+
+async def set_file_id(ascension_id: int, file_id: str):
+    await write(lambda conn: conn.execute("UPDATE ascensions SET file_id = ? WHERE id = ?", (file_id, ascension_id)))
+
+
+async def recent_file_ids(user_id: int, limit: int = 20):
+    """گواهی‌های اخیر کاربر که file_id دارند: (id, plan, burden, dna, file_id)"""
+    return await read(lambda conn: conn.execute(
+        "SELECT id, plan, burden, dna, file_id FROM ascensions WHERE user_id = ? AND file_id IS NOT NULL "
+        "ORDER BY timestamp DESC, id DESC LIMIT ?", (user_id, limit)).fetchall())
+
+
+def encode_cursor(timestamp: str, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """برگرداندن (timestamp, id)؛ برای cursor نامعتبر ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit("|", 1)
+        return timestamp, int(row_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def _gallery(conn, user_id, limit, cursor):
+    # keyset pagination روی ایندکس (user_id, timestamp)؛ id جلوی تکرار در timestampهای برابر را می‌گیرد
+    if cursor:
+        rows = conn.execute(
+            "SELECT id, image_url, plan, dna, burden, timestamp, thumb_url, webp_url FROM ascensions "
+            "WHERE user_id = ? AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (user_id, *cursor, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, image_url, plan, dna, burden, timestamp, thumb_url, webp_url FROM ascensions "
+            "WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (user_id, limit + 1)).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][5], rows[limit - 1][0]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+async def gallery(user_id: int, limit: int, cursor=None):
+    """یک صفحه از گالری کاربر و cursor صفحه‌ی بعد (یا None)"""
+    return await read(_gallery, user_id, limit, cursor)
+
+
+# --- آمار پنل ادمین ---
+def _admin_stats(conn):
+    today = _today(conn)
+    keys = ("users", "ascensions", "free_mints", "plan:Eternal", f"day:{today}")
+    values = dict(conn.execute(f"SELECT key, value FROM stats WHERE key IN ({','.join('?' * len(keys))})",
+                               keys).fetchall())
+    total_ascensions = values.get("ascensions", 0)
+    return {
+        "total_users": values.get("users", 0),
+        "total_ascensions": total_ascensions,
+        "paid_ascensions": total_ascensions - values.get("plan:Eternal", 0),
+        "remaining_free": values.get("free_mints", 0),
+        "today_ascensions": values.get(f"day:{today}", 0),
+    }
+
+
+async def admin_stats() -> dict:
+    """آمار پنل از جدول stats؛ مستقل از اندازه‌ی جدول‌ها"""
+    return await read(_admin_stats)
+
+
+# --- پیام همگانی ---
+BROADCAST_COLUMNS = ("id", "from_chat_id", "message_id", "status_chat_id", "status_message_id",
+                     "status", "total", "sent", "failed", "last_user_id")
+
+
+def _create_broadcast(conn, from_chat_id, message_id, status_chat_id, status_message_id, owner):
+    c = conn.execute(
+        "INSERT INTO broadcasts (from_chat_id, message_id, status_chat_id, status_message_id, owner, total) "
+        "VALUES (?, ?, ?, ?, ?, COALESCE((SELECT value FROM stats WHERE key = 'users'), 0))",
+        (from_chat_id, message_id, status_chat_id, status_message_id, owner))
+    return c.lastrowid
+
+
+async def create_broadcast(from_chat_id: int, message_id: int, status_chat_id: int, status_message_id: int,
+                           owner: str) -> int:
+    return await write(_create_broadcast, from_chat_id, message_id, status_chat_id, status_message_id, owner)
+
+
+async def get_broadcast(broadcast_id: int):
+    row = await read(lambda conn: conn.execute(
+        f"SELECT {', '.join(BROADCAST_COLUMNS)} FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone())
+    return dict(zip(BROADCAST_COLUMNS, row)) if row else None
+
+
+async def claim_orphaned_broadcasts(owner: str, alive_after: float):
+    """پیام‌های running که مالکشان ضربان تازه ندارد به owner منتقل می‌شوند؛ شناسه‌ی همان‌ها برمی‌گردد"""
+    return await write(lambda conn: sorted(row[0] for row in conn.execute(
+        "UPDATE broadcasts SET owner = ? WHERE status = 'running' AND NOT EXISTS "
+        "(SELECT 1 FROM processes p WHERE p.id = broadcasts.owner AND p.heartbeat >= ?) RETURNING id",
+        (owner, alive_after)).fetchall()))
+
+
+async def broadcast_recipients(broadcast_id: int, after_user_id: int, limit: int):
+    """دسته‌ی بعدی گیرنده‌ها به ترتیب id؛ کسانی که قبلا دریافت کرده‌اند رد می‌شوند"""
+    return await read(lambda conn: [row[0] for row in conn.execute(
+        "SELECT id FROM users u WHERE id > ? AND NOT EXISTS ("
+        "SELECT 1 FROM broadcast_deliveries d WHERE d.broadcast_id = ? AND d.user_id = u.id) "
+        "ORDER BY id LIMIT ?", (after_user_id, broadcast_id, limit))])
+
+
+def _record_delivery(conn, broadcast_id, user_id, status):
+    c = conn.execute("INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES (?, ?, ?)",
+                     (broadcast_id, user_id, status))
+    if c.rowcount == 0:
+        return
+    column = "sent" if status == "sent" else "failed"
+    conn.execute(f"UPDATE broadcasts SET {column} = {column} + 1 WHERE id = ?", (broadcast_id,))
+
+
+async def record_delivery(broadcast_id: int, user_id: int, status: str):
+    await write(_record_delivery, broadcast_id, user_id, status)
+
+
+async def advance_broadcast(broadcast_id: int, last_user_id: int, owner: str) -> bool:
+    """False اگر پیام به پروسه‌ی دیگری منتقل شده است"""
+    changed = await write(lambda conn: conn.execute(
+        "UPDATE broadcasts SET last_user_id = ? WHERE id = ? AND owner = ?",
+        (last_user_id, broadcast_id, owner)).rowcount)
+    return changed > 0
+
+
+async def finish_broadcast(broadcast_id: int):
+    await write(lambda conn: conn.execute(
+        "UPDATE broadcasts SET status = 'done', finished = CURRENT_TIMESTAMP WHERE id = ?", (broadcast_id,)))
+
+
+# --- فایل‌های خروجی ---
+# مجموع حجم در stats (کلید storage_bytes) نگه داشته می‌شود تا بررسی سهمیه یک سطر بخواند
+def _index_files(conn, ascension_id, files, created=None):
+    created = created or time.time()
+    for key, size in files:
+        old = conn.execute("SELECT size FROM files WHERE key = ?", (key,)).fetchone()
+        conn.execute("INSERT OR REPLACE INTO files (key, ascension_id, size, created) VALUES (?, ?, ?, ?)",
+                     (key, ascension_id, size, created))
+        _bump(conn, "storage_bytes", size - (old[0] if old else 0))
+
+
+async def index_files(files, ascension_id: int = None, created: float = None):
+    await write(_index_files, ascension_id, files, created)
+
+
+async def storage_bytes() -> int:
+    row = await read(lambda conn: conn.execute("SELECT value FROM stats WHERE key = 'storage_bytes'").fetchone())
+    return row[0] if row else 0
+
+
+async def retention_candidates(cutoff: float, limit: int):
+    """قدیمی‌ترین فایل‌های قبل از cutoff
+
+    گواهی‌ای که هنوز file_id تلگرام ندارد حذف نمی‌شود، و thumbnail گالری (یا تنها تصویر
+    گواهی‌های قدیمی بدون thumbnail) همیشه می‌ماند تا کارت‌های گالری سالم بمانند.
+    """
+    return await read(lambda conn: conn.execute(
+        "SELECT f.key, f.size FROM files f LEFT JOIN ascensions a ON a.id = f.ascension_id "
+        "WHERE f.created < ? AND (f.ascension_id IS NULL OR (a.file_id IS NOT NULL AND a.thumb_url IS NOT NULL "
+        "AND substr(a.thumb_url, -length(f.key)) != f.key)) "
+        "ORDER BY f.created LIMIT ?", (cutoff, limit)).fetchall())
+
+
+def _forget_files(conn, files, owners):
+    for key, url in files:
+        row = conn.execute("DELETE FROM files WHERE key = ? RETURNING size, ascension_id", (key,)).fetchone()
+        if not row:
+            continue
+        _bump(conn, "storage_bytes", -row[0])
+        if row[1] is not None:
+            # گالری به thumbnail برمی‌گردد و به فایل حذف‌شده لینک نمی‌دهد
+            owner = conn.execute("UPDATE ascensions SET "
+                                 "image_url = CASE WHEN image_url = ?1 THEN NULL ELSE image_url END, "
+                                 "webp_url = CASE WHEN webp_url = ?1 THEN NULL ELSE webp_url END "
+                                 "WHERE id = ?2 RETURNING user_id", (url, row[1])).fetchone()
+            if owner:
+                owners.add(owner[0])
+
+
+async def forget_files(files, on_commit=None):
+    """files: جفت‌های (key, url)؛ صاحبان گواهی‌هایی که URLشان پاک شد به مجموعه‌ی برگشتی اضافه می‌شوند"""
+    owners = set()
+    await write(_forget_files, files, owners, on_commit=on_commit and (lambda: on_commit(owners)))
+    return owners
+
+
+async def url_owners() -> dict:
+    """نگاشت URL فایل به id گواهی؛ فقط یک بار برای فشرده‌سازی فایل‌های قدیمی"""
+    def owners(conn):
+        mapping = {}
+        for row in conn.execute("SELECT id, image_url, thumb_url, webp_url FROM ascensions"):
+            for url in row[1:]:
+                if url:
+                    mapping[url] = row[0]
+        return mapping
+    return await read(owners)
+
+
+def _relocate_file(conn, ascension_id, old_url, new_url, key, size, created):
+    if ascension_id is not None:
+        conn.execute("UPDATE ascensions SET "
+                     "image_url = CASE WHEN image_url = ?1 THEN ?2 ELSE image_url END, "
+                     "thumb_url = CASE WHEN thumb_url = ?1 THEN ?2 ELSE thumb_url END, "
+                     "webp_url = CASE WHEN webp_url = ?1 THEN ?2 ELSE webp_url END WHERE id = ?3",
+                     (old_url, new_url, ascension_id))
+    _index_files(conn, ascension_id, [(key, size)], created)
+
+
+async def relocate_file(ascension_id, old_url: str, new_url: str, key: str, size: int, created: float):
+    """فایل قدیمی تخت به شارد منتقل شده؛ URL گواهی و فهرست در یک تراکنش عوض می‌شوند"""
+    await write(_relocate_file, ascension_id, old_url, new_url, key, size, created)
+
+
+# --- FSM مشترک ---
+async def fsm_get(key: str):
+    """(state, data به صورت JSON) یا (None, None)"""
+    row = await read(lambda conn: conn.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone())
+    return row if row else (None, None)
+
+
+def _fsm_set(conn, key, column, value):
+    conn.execute(f"INSERT INTO fsm (key, {column}) VALUES (?, ?) "
+                 f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}", (key, value))
+    conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND (data IS NULL OR data = '{}')", (key,))
+
+
+async def fsm_set_state(key: str, state):
+    await write(_fsm_set, key, "state", state)
+
+
+async def fsm_set_data(key: str, data: str):
+    await write(_fsm_set, key, "data", data)
+
+
+# --- ضربان پروسه‌ها ---
+async def beat(process_id: str):
+    await write(lambda conn: conn.execute(
+        "INSERT INTO processes (id, heartbeat) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET heartbeat = excluded.heartbeat",
+        (process_id, time.time())))
+
+
+async def forget_process(process_id: str):
+    await write(lambda conn: conn.execute("DELETE FROM processes WHERE id = ?", (process_id,)))
+
+
+# --- کارهای مینت ---
+MINT_JOB_COLUMNS = ("id", "key", "status", "result", "error", "created", "finished")
+# alive: مالک کار هنوز ضربان می‌زند؛ کارهای بدون مالک (قبل از مهاجرت ۹) مرده حساب می‌شوند
+_MINT_JOB_SELECT = (f"SELECT {', '.join(MINT_JOB_COLUMNS)}, EXISTS (SELECT 1 FROM processes p "
+                    f"WHERE p.id = mint_jobs.owner AND p.heartbeat >= ?) FROM mint_jobs")
+
+
+def _mint_job(row):
+    return dict(zip(MINT_JOB_COLUMNS + ("alive",), row)) if row else None
+
+
+async def save_mint_job(job_id: str, key, created: float, owner: str, refund_user: int = None):
+    await write(lambda conn: conn.execute(
+        "INSERT INTO mint_jobs (id, key, status, created, owner, refund_user) VALUES (?, ?, 'queued', ?, ?, ?)",
+        (job_id, key, created, owner, refund_user)))
+
+
+def _claim_mint_job(conn, job_id, key, created, owner, expired_before, alive_after, error):
+    if expired_before is not None:
+        # کار موفقی که پنجره‌ی تکراری‌اش گذشته کلید را آزاد می‌کند
+        conn.execute("UPDATE mint_jobs SET key = NULL WHERE key = ? AND status = 'success' AND finished < ?",
+                     (key, expired_before))
+    for (orphan,) in conn.execute("SELECT id FROM mint_jobs WHERE key = ? AND status IN ('queued', 'running')",
+                                  (key,)).fetchall():
+        _fail_orphaned_mint_job(conn, orphan, error, alive_after)
+    if conn.execute("INSERT INTO mint_jobs (id, key, status, created, owner) VALUES (?, ?, 'queued', ?, ?) "
+                    "ON CONFLICT DO NOTHING RETURNING id", (job_id, key, created, owner)).fetchone():
+        return None
+    return conn.execute("SELECT id FROM mint_jobs WHERE key = ? AND status != 'failed'", (key,)).fetchone()[0]
+
+
+async def claim_mint_job(job_id: str, key: str, created: float, owner: str, expired_before: float,
+                         alive_after: float, error: str):
+    """ثبت اتمیک کلید برای این کار؛ None اگر برنده شد، وگرنه شناسه‌ی کار زنده‌ی قبلی با همین کلید"""
+    return await write(_claim_mint_job, job_id, key, created, owner, expired_before, alive_after, error)
+
+
+async def release_mint_job(job_id: str):
+    """کلید ادعاشده‌ای که مینتش پذیرفته نشد (403، 400، 503، 429)"""
+    await write(lambda conn: conn.execute("DELETE FROM mint_jobs WHERE id = ? AND status = 'queued'", (job_id,)))
+
+
+async def set_mint_job_refund(job_id: str, refund_user: int):
+    await write(lambda conn: conn.execute("UPDATE mint_jobs SET refund_user = ? WHERE id = ?", (refund_user, job_id)))
+
+
+def _update_mint_job(conn, job_id, status, result, error, finished):
+    # کار failed دیگر تغییر نمی‌کند، پس مینت رایگانش دقیقاً یک بار برمی‌گردد
+    row = conn.execute("UPDATE mint_jobs SET status = ?, result = ?, error = ?, finished = ? "
+                       "WHERE id = ? AND status != 'failed' RETURNING refund_user",
+                       (status, result, error, finished, job_id)).fetchone()
+    if row and row[0] is not None and status == "failed":
+        _refund_free_mint(conn, row[0])
+
+
+async def update_mint_job(job_id: str, status: str, result: str = None, error: str = None, finished: float = None):
+    await write(_update_mint_job, job_id, status, result, error, finished)
+
+
+async def get_mint_job(job_id: str, alive_after: float):
+    return _mint_job(await read(lambda conn: conn.execute(
+        f"{_MINT_JOB_SELECT} WHERE id = ?", (alive_after, job_id)).fetchone()))
+
+
+async def find_mint_job(key: str, alive_after: float):
+    """آخرین کار ثبت‌شده با این کلید idempotency در هر worker"""
+    return _mint_job(await read(lambda conn: conn.execute(
+        f"{_MINT_JOB_SELECT} WHERE key = ? ORDER BY created DESC LIMIT 1", (alive_after, key)).fetchone()))
+
+
+def _fail_orphaned_mint_job(conn, job_id, error, alive_after):
+    row = conn.execute("UPDATE mint_jobs SET status = 'failed', error = ?, finished = ? "
+                       "WHERE id = ? AND status IN ('queued', 'running') AND NOT EXISTS "
+                       "(SELECT 1 FROM processes p WHERE p.id = mint_jobs.owner AND p.heartbeat >= ?) "
+                       "RETURNING refund_user", (error, time.time(), job_id, alive_after)).fetchone()
+    if row and row[0] is not None:
+        _refund_free_mint(conn, row[0])
+    return row is not None
+
+
+async def fail_orphaned_mint_job(job_id: str, error: str, alive_after: float) -> bool:
+    """کار ناتمامی که مالکش مرده failed می‌شود؛ False اگر در این فاصله تمام شده یا مالک زنده است"""
+    return await write(_fail_orphaned_mint_job, job_id, error, alive_after)
+
+
+def _fail_orphaned_mint_jobs(conn, error, alive_after):
+    rows = conn.execute("UPDATE mint_jobs SET status = 'failed', error = ?, finished = ? "
+                        "WHERE status IN ('queued', 'running') AND NOT EXISTS "
+                        "(SELECT 1 FROM processes p WHERE p.id = mint_jobs.owner AND p.heartbeat >= ?) "
+                        "RETURNING refund_user", (error, time.time(), alive_after)).fetchall()
+    for (user_id,) in rows:
+        if user_id is not None:
+            _refund_free_mint(conn, user_id)
+    return len(rows)
+
+
+async def fail_orphaned_mint_jobs(error: str, alive_after: float) -> int:
+    """همه‌ی کارهای ناتمام مالک‌های مرده؛ مینت رایگانشان حتی اگر کسی وضعیت را نپرسد برمی‌گردد"""
+    return await write(_fail_orphaned_mint_jobs, error, alive_after)
+
+
+async def prune_mint_jobs(cutoff: float):
+    # کار ناتمامی که مینت رایگان گرفته تا failed شدن و برگشت مینت نگه داشته می‌شود
+    await write(lambda conn: conn.execute(
+        "DELETE FROM mint_jobs WHERE created < ? "
+        "AND NOT (status IN ('queued', 'running') AND refund_user IS NOT NULL)", (cutoff,)))
@@ -0,0 +1,30 @@
+import json
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+import db
+
+
+def storage_key(key: StorageKey) -> str:
+    return ":".join(str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                           key.business_connection_id, key.destiny))
+
+
+class SQLiteStorage(BaseStorage):
+    """حالت FSM در SQLite؛ همه‌ی workerها مراحل پنل ادمین را مشترک می‌بینند"""
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        await db.fsm_set_state(storage_key(key), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey):
+        state, _ = await db.fsm_get(storage_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        await db.fsm_set_data(storage_key(key), json.dumps(data))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        _, data = await db.fsm_get(storage_key(key))
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,70 @@
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# --- تنظیمات کش گالری ---
+GALLERY_CACHE_SIZE = int(os.getenv("GALLERY_CACHE_SIZE", "5000"))
+# هر worker کش خودش را دارد و فقط مینت‌های خودش را می‌بیند؛ با چند worker صفحه‌ها بعد از این مدت
+# دوباره از دیتابیس خوانده می‌شوند. 0 یعنی بدون انقضا
+GALLERY_CACHE_TTL = float(os.getenv("GALLERY_CACHE_TTL", "0" if os.getenv("WEB_CONCURRENCY", "1") == "1" else "10"))
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class GalleryCache:
+    """LRU بدنه‌ی JSON آماده‌ی صفحه‌های گالری با ETag قوی، کلید (user_id, limit, cursor)"""
+
+    def __init__(self, size: int = GALLERY_CACHE_SIZE, ttl: float = GALLERY_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.pages = OrderedDict()
+        # نسل هر کاربر با هر مینت بالا می‌رود؛ خواندنی که قبل از مینت شروع شده کش نمی‌شود
+        self.generations = OrderedDict()
+
+    def get(self, key):
+        """(body, etag) یا None"""
+        entry = self.pages.get(key)
+        if entry is None:
+            return None
+        body, etag, generation, stored = entry
+        if generation != self.generations.get(key[0], 0) or (self.ttl and time.monotonic() - stored > self.ttl):
+            del self.pages[key]
+            return None
+        self.pages.move_to_end(key)
+        return body, etag
+
+    def generation(self, user_id: int) -> int:
+        return self.generations.get(user_id, 0)
+
+    def put(self, key, body: bytes, generation: int):
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if generation == self.generation(key[0]):
+            self.pages[key] = (body, etag, generation, time.monotonic())
+            if len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+        return body, etag
+
+    def invalidate(self, user_id: int):
+        for key in [key for key in self.pages if key[0] == user_id]:
+            del self.pages[key]
+        self.generations[user_id] = self.generations.pop(user_id, 0) + 1
+        # نسل فقط برای خواندن‌های هم‌زمان با مینت لازم است، پس قدیمی‌ترین‌ها دور ریخته می‌شوند
+        if len(self.generations) > self.size:
+            self.generations.popitem(last=False)
+
+    def clear(self):
+        self.pages.clear()
+
+
+cache = GalleryCache()
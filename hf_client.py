@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات کلاینت Hugging Face ---
+HF_API_TOKEN = os.getenv("HF_API_TOKEN")
+HF_API_BASE = os.getenv("HF_API_BASE", "https://api-inference.huggingface.co").rstrip("/")
+# سقف کل یک inference، با همه‌ی تلاش‌ها و backoffها؛ worker مینت بیش از این منتظر HF نمی‌ماند
+HF_TIMEOUT = float(os.getenv("HF_TIMEOUT", "90"))
+HF_POOL_SIZE = int(os.getenv("HF_POOL_SIZE", "16"))
+HF_MAX_CONCURRENCY = int(os.getenv("HF_MAX_CONCURRENCY", "4"))
+HF_RETRIES = int(os.getenv("HF_RETRIES", "3"))
+HF_BACKOFF_BASE = float(os.getenv("HF_BACKOFF_BASE", "2"))
+HF_BACKOFF_MAX = float(os.getenv("HF_BACKOFF_MAX", "30"))
+HF_BREAKER_THRESHOLD = int(os.getenv("HF_BREAKER_THRESHOLD", "5"))
+HF_BREAKER_COOLDOWN = float(os.getenv("HF_BREAKER_COOLDOWN", "60"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """بعد از چند شکست پشت سر هم، تا پایان cooldown درخواستی به HF نمی‌رود"""
+
+    def __init__(self, threshold: int = HF_BREAKER_THRESHOLD, cooldown: float = HF_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half-open" or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            logger.warning(f"HF circuit breaker opened after {self.failures} failures")
+
+
+breaker = CircuitBreaker()
+_semaphore = asyncio.Semaphore(HF_MAX_CONCURRENCY)
+_session = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=HF_POOL_SIZE, keepalive_timeout=60, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HF_TIMEOUT))
+    return _session
+
+
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _backoff(attempt: int, hint: float = 0) -> float:
+    # backoff نمایی با jitter؛ اگر HF زمان بارگذاری مدل را اعلام کرده باشد همان مبنا قرار می‌گیرد
+    ceiling = min(HF_BACKOFF_MAX, max(hint, HF_BACKOFF_BASE * (2 ** attempt)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+async def inference(api_url: str, payload: dict):
+    """ارسال درخواست به HF؛ در صورت شکست None برمی‌گرداند تا fallback اجرا شود"""
+    if not HF_API_TOKEN:
+        return None
+    if not breaker.allow():
+        metrics.hf_requests.inc(outcome="breaker_open")
+        logger.warning("HF circuit breaker open - skipping inference")
+        return None
+
+    headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
+    session = _get_session()
+    deadline = time.monotonic() + HF_TIMEOUT
+    for attempt in range(HF_RETRIES + 1):
+        hint = 0
+        try:
+            async with _semaphore:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                with metrics.hf_request_seconds.time():
+                    async with session.post(api_url, headers=headers, json=payload,
+                                            timeout=aiohttp.ClientTimeout(total=remaining)) as response:
+                        body = await response.read()
+                if response.status == 200:
+                    metrics.hf_requests.inc(outcome="success")
+                    breaker.record_success()
+                    return body
+            metrics.hf_requests.inc(outcome=f"http_{response.status}")
+            logger.error(f"HF API Error: {response.status} - {body[:200]!r}")
+            loading = b"loading" in body.lower()
+            if response.status not in RETRY_STATUSES and not loading:
+                break
+            if loading:
+                try:
+                    hint = float(json.loads(body).get("estimated_time", 0))
+                except Exception:
+                    hint = 0
+        except asyncio.TimeoutError:
+            # مهلت کل تمام شده؛ تلاش دوباره فقط worker مینت را بیشتر نگه می‌داشت
+            metrics.hf_requests.inc(outcome="timeout")
+            logger.error(f"HF Request timed out after {HF_TIMEOUT:.0f}s")
+            break
+        except aiohttp.ClientError as e:
+            metrics.hf_requests.inc(outcome="network_error")
+            logger.error(f"HF Request failed: {e!r}")
+        if attempt < HF_RETRIES:
+            delay = _backoff(attempt, hint)
+            if time.monotonic() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+
+    breaker.record_failure()
+    return None
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import contextvars
+import metrics
+import leader
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات صف مینت ---
+MINT_WORKERS = int(os.getenv("MINT_WORKERS", "2"))
+MINT_QUEUE_SIZE = int(os.getenv("MINT_QUEUE_SIZE", "100"))
+MINT_JOB_TTL = int(os.getenv("MINT_JOB_TTL", "3600"))
+# کلیدهای ساخته‌شده از خود ورودی فقط در این بازه بعد از اتمام کار تکراری حساب می‌شوند
+MINT_DEDUP_WINDOW = int(os.getenv("MINT_DEDUP_WINDOW", "60"))
+# کارهای worker دیگر از دیتابیس poll می‌شوند
+MINT_EVENTS_POLL = float(os.getenv("MINT_EVENTS_POLL", "1"))
+# رهبر هر این‌قدر کارهای یتیم workerهای مرده را failed می‌کند و مینت رایگانشان را برمی‌گرداند
+MINT_ORPHAN_SWEEP_INTERVAL = float(os.getenv("MINT_ORPHAN_SWEEP_INTERVAL", "60"))
+
+# آخرین رویداد هر کار؛ بعد از آن جریان SSE بسته می‌شود
+DONE_STAGES = ("delivered", "failed")
+# کار ناتمام پروسه‌ای که متوقف شده یا مرده
+RESTARTED_ERROR = "The Void was restarted."
+# وضعیت ذخیره‌شده در mint_jobs به نزدیک‌ترین مرحله (برای کار پروسه‌ی دیگر)
+STATUS_STAGES = {"queued": "queued", "running": "generating", "success": "delivered", "failed": "failed"}
+
+_current = contextvars.ContextVar("mint_job", default=None)
+
+
+class MintQueue:
+    """صف محدود داخل پروسه برای اجرای مینت‌ها در پس‌زمینه
+
+    وضعیت هر کار در جدول mint_jobs هم نوشته می‌شود تا وقتی چند worker اجرا می‌شوند
+    polling وضعیت و کلید idempotency به هر پروسه‌ای که برسد جواب بگیرد.
+    """
+
+    def __init__(self, workers: int = MINT_WORKERS, maxsize: int = MINT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.jobs = {}
+        self.keys = {}
+        self.running = 0
+        # میانگین متحرک زمان اجرای هر مینت برای تخمین زمان انتظار صف
+        self.avg_runtime = 5.0
+        self._tasks = []
+        self._pruned_at = 0
+        # با هر رویداد set و عوض می‌شود تا همه‌ی شنونده‌ها بیدار شوند
+        self._changed = asyncio.Event()
+
+    async def claim(self, key: str, window: float = None):
+        """(job_id, None) اگر کلید برای کار تازه ثبت شد، وگرنه (None, کار قبلی)
+
+        ادعا در خود SQLite اتمیک است؛ دو درخواست یکسان که به دو worker برسند یک کار می‌سازند.
+        کار ادعاشده یا با submit(job_id=...) ثبت می‌شود یا با release آزاد.
+        """
+        job_id = uuid.uuid4().hex
+        winner = await db.claim_mint_job(job_id, key, time.time(), leader.PROCESS_ID,
+                                         time.time() - window if window is not None else None,
+                                         leader.alive_after(), RESTARTED_ERROR)
+        if winner is None:
+            return job_id, None
+        return None, await self.get(winner)
+
+    async def release(self, job_id: str):
+        await db.release_mint_job(job_id)
+
+    async def submit(self, func, *args, key: str = None, refund_user: int = None, job_id: str = None) -> str:
+        """ثبت کار جدید؛ اگر صف پر باشد asyncio.QueueFull پرتاب می‌شود
+
+        refund_user: اگر کار شکست بخورد (یا با مرگ پروسه ناتمام بماند) یک مینت رایگان به این کاربر برمی‌گردد.
+        job_id: کاری که با claim ادعا شده و سطرش از قبل در mint_jobs هست.
+        """
+        await self._prune()
+        claimed = job_id is not None
+        job_id = job_id or uuid.uuid4().hex
+        self.queue.put_nowait((job_id, func, args))
+        job = self.jobs[job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "created": time.time(),
+            "result": None,
+            "error": None,
+            "trace_id": metrics.trace_id.get(),
+            "key": key,
+            "events": [],
+        }
+        if key:
+            self.keys[key] = job_id
+        self._emit(job, "queued", {"position": self.queue.qsize()})
+        # نوشتن‌ها روی thread نویسنده به ترتیب اجرا می‌شوند، پس این insert قبل از update worker است
+        if not claimed:
+            await db.save_mint_job(job_id, key, job["created"], leader.PROCESS_ID, refund_user)
+        elif refund_user is not None:
+            await db.set_mint_job_refund(job_id, refund_user)
+        return job_id
+
+    async def get(self, job_id: str):
+        """کار این پروسه، یا اگر worker دیگری ثبتش کرده از دیتابیس"""
+        return self.jobs.get(job_id) or await _stored(await db.get_mint_job(job_id, leader.alive_after()))
+
+    async def find(self, key: str, window: float = None):
+        """کار قبلی با همین کلید idempotency؛ کار شکست‌خورده دوباره اجرا می‌شود"""
+        job = self.jobs.get(self.keys.get(key)) or await _stored(await db.find_mint_job(key, leader.alive_after()))
+        if job is None or job["status"] == "failed":
+            return None
+        if window is not None and job.get("finished", time.time()) < time.time() - window:
+            return None
+        return job
+
+    async def events(self, job_id: str, keepalive: float):
+        """رویدادهای (stage, data) کار به ترتیب، از اول؛ None یعنی keepalive. با delivered یا failed تمام می‌شود"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            async for event in _polled_events(job_id, keepalive):
+                yield event
+            return
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(job["events"]):
+                event = job["events"][sent]
+                sent += 1
+                yield event
+                if event[0] in DONE_STAGES:
+                    return
+            try:
+                await asyncio.wait_for(changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    def _emit(self, job: dict, stage: str, data: dict):
+        job["events"].append((stage, data))
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def inflight(self) -> int:
+        return self.queue.qsize() + self.running
+
+    def estimated_wait(self) -> float:
+        """زمان تقریبی تا شروع کاری که الان ثبت شود"""
+        return self.queue.qsize() * self.avg_runtime / max(1, self.workers)
+
+    def start(self):
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        logger.info(f"Mint queue started with {self.workers} workers")
+
+    def sweep_orphans(self):
+        """فقط در رهبر: کارهای ناتمام پروسه‌های مرده در پس‌زمینه جمع می‌شوند؛ با stop متوقف می‌شود"""
+        task = asyncio.create_task(self._sweep())
+        self._tasks.append(task)
+        return task
+
+    async def _sweep(self):
+        while True:
+            try:
+                swept = await db.fail_orphaned_mint_jobs(RESTARTED_ERROR, leader.alive_after())
+                if swept:
+                    logger.warning(f"Marked {swept} orphaned mint jobs failed")
+            except Exception as e:
+                logger.error(f"Orphaned mint job sweep failed: {e}")
+            await asyncio.sleep(MINT_ORPHAN_SWEEP_INTERVAL)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # کارهای صف و در حال اجرا با این پروسه از بین می‌روند؛ درخواست تکراری باید دوباره ثبت شود
+        for job in self.jobs.values():
+            if job["status"] in ("queued", "running"):
+                job["status"] = "failed"
+                job["error"] = RESTARTED_ERROR
+                job["finished"] = time.time()
+                self._emit(job, "failed", {"error": job["error"]})
+                await _persist(job)
+
+    async def _worker(self, n: int):
+        while True:
+            job_id, func, args = await self.queue.get()
+            job = self.jobs[job_id]
+            job["status"] = "running"
+            _current.set((self, job))
+            await _persist(job)
+            # trace id درخواستی که کار را ثبت کرده در لاگ‌های worker هم دیده می‌شود
+            metrics.new_trace(job["trace_id"])
+            started = time.time()
+            metrics.mint_queue_wait_seconds.observe(started - job["created"])
+            self.running += 1
+            try:
+                job["result"] = await func(*args)
+                job["status"] = "success"
+            except Exception as e:
+                logger.error(f"Mint job {job_id} failed on worker {n}: {e}")
+                job["status"] = "failed"
+                job["error"] = "The Void is restless."
+            finally:
+                _current.set(None)
+                job["finished"] = time.time()
+                self.running -= 1
+                self.avg_runtime = 0.8 * self.avg_runtime + 0.2 * (job["finished"] - started)
+                metrics.mint_job_seconds.observe(job["finished"] - started, status=job["status"])
+                self.queue.task_done()
+            if job["status"] == "success":
+                self._emit(job, "delivered", job["result"])
+            else:
+                self._emit(job, "failed", {"error": job["error"]})
+            await _persist(job)
+
+    async def _prune(self):
+        # کارهای تمام‌شده بعد از TTL پاک می‌شوند تا حافظه رشد نکند
+        cutoff = time.time() - MINT_JOB_TTL
+        if time.time() - self._pruned_at > 60:
+            self._pruned_at = time.time()
+            await db.prune_mint_jobs(cutoff)
+        expired = [jid for jid, job in self.jobs.items() if job.get("finished", time.time()) < cutoff]
+        for jid in expired:
+            key = self.jobs.pop(jid)["key"]
+            if key and self.keys.get(key) == jid:
+                del self.keys[key]
+
+
+def report(stage: str, **data):
+    """مرحله‌ی کار در حال اجرا برای شنونده‌های SSE؛ بیرون از صف (مثلاً مینت ادمین) کاری نمی‌کند"""
+    current = _current.get()
+    if current is not None:
+        queue, job = current
+        queue._emit(job, stage, data)
+
+
+async def _polled_events(job_id: str, keepalive: float):
+    # کار در پروسه‌ی دیگری اجرا می‌شود؛ فقط تغییر وضعیت‌ها از mint_jobs دیده می‌شوند
+    status, idle = None, 0.0
+    while True:
+        job = await _stored(await db.get_mint_job(job_id, leader.alive_after()))
+        if job is None:
+            return
+        if job["status"] != status:
+            status, idle = job["status"], 0.0
+            stage = STATUS_STAGES[status]
+            if status == "success":
+                yield stage, job["result"]
+            elif status == "failed":
+                yield stage, {"error": job["error"]}
+            else:
+                yield stage, {}
+            if stage in DONE_STAGES:
+                return
+        elif idle >= keepalive:
+            idle = 0.0
+            yield None
+        await asyncio.sleep(MINT_EVENTS_POLL)
+        idle += MINT_EVENTS_POLL
+
+
+async def _persist(job: dict):
+    # خطای دیتابیس نباید worker صف را بکشد؛ همین پروسه هنوز وضعیت را در حافظه دارد
+    try:
+        result = json.dumps(job["result"]) if job["result"] is not None else None
+        await db.update_mint_job(job["id"], job["status"], result, job["error"], job.get("finished"))
+    except Exception as e:
+        logger.error(f"Mint job {job['id']} status not saved: {e}")
+
+
+async def _stored(row):
+    """کار ذخیره‌شده‌ی پروسه‌ی دیگر؛ اگر مالکش دیگر ضربان نمی‌زند ناتمام نمی‌ماند و failed می‌شود"""
+    if row is not None and not row["alive"] and row["status"] in ("queued", "running"):
+        if await db.fail_orphaned_mint_job(row["id"], RESTARTED_ERROR, leader.alive_after()):
+            logger.warning(f"Mint job {row['id']} orphaned by a dead worker, marked failed")
+            row.update(status="failed", error=RESTARTED_ERROR, finished=time.time())
+        else:
+            row = await db.get_mint_job(row["id"], leader.alive_after())
+    return _from_row(row)
+
+
+def _from_row(row):
+    if row is None:
+        return None
+    del row["alive"]
+    row["result"] = json.loads(row["result"]) if row["result"] else None
+    if row["finished"] is None:
+        del row["finished"]
+    return row
@@ -0,0 +1,128 @@
+import os
+import time
+import uuid
+import fcntl
+import asyncio
+import logging
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات انتخاب رهبر ---
+# قفل فایل کنار دیتابیس؛ همه‌ی workerهای یک ماشین همان فایل را می‌بینند
+LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH", f"{db.DB_PATH}.leader")
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "10"))
+# رهبری که راه‌اندازی‌اش شکست خورده با این سقف عقب‌نشینی دوباره تلاش می‌کند
+LEADER_MAX_BACKOFF = float(os.getenv("LEADER_MAX_BACKOFF", "300"))
+
+# --- تنظیمات ضربان پروسه ---
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "5"))
+# پروسه‌ای که این مدت ضربان نزده مرده حساب می‌شود و کارهایش یتیم‌اند
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "30"))
+# pid به‌تنهایی بعد از ری‌استارت دوباره استفاده می‌شود
+PROCESS_ID = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def alive_after() -> float:
+    """ضربان‌های قدیمی‌تر از این زمان مال پروسه‌ی مرده‌اند"""
+    return time.time() - HEARTBEAT_TIMEOUT
+
+
+class LeaderLock:
+    """فقط پروسه‌ای که flock انحصاری را دارد وبهوک و کارهای پس‌زمینه‌ی سراسری را اجرا می‌کند
+
+    قفل با مرگ پروسه خودبه‌خود آزاد می‌شود و یکی از workerهای دیگر جای آن را می‌گیرد.
+    """
+
+    def __init__(self, path: str = LEADER_LOCK_PATH):
+        self.path = path
+        self._fd = None
+        self._task = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def start(self, on_elected):
+        """تلاش فوری برای رهبری و بعد تلاش دوباره در پس‌زمینه تا وقتی رهبر فعلی بمیرد"""
+        self._task = asyncio.create_task(self._watch(on_elected))
+        return self._task
+
+    async def _watch(self, on_elected):
+        # on_elected(True) یعنی رهبر از همان شروع پروسه؛ False یعنی جای رهبر مرده را گرفته
+        at_startup = True
+        failures = 0
+        while True:
+            while not self.try_acquire():
+                at_startup = False
+                await asyncio.sleep(LEADER_RETRY_INTERVAL)
+            logger.info(f"Process {os.getpid()} elected leader")
+            try:
+                await on_elected(at_startup)
+                return
+            except Exception as e:
+                # مثلاً set_webhook روی قطعی شبکه؛ قفل آزاد می‌شود تا این پروسه یا worker دیگری دوباره تلاش کند
+                failures += 1
+                delay = min(LEADER_RETRY_INTERVAL * 2 ** (failures - 1), LEADER_MAX_BACKOFF)
+                logger.error(f"Leader startup failed, releasing leadership for {delay:.0f}s: {e}")
+                self.release()
+                await asyncio.sleep(delay)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class Heartbeat:
+    """ضربان این پروسه در جدول processes
+
+    کارهای مینت با شناسه‌ی مالک ثبت می‌شوند؛ workerهای دیگر کاری را که مالکش دیگر ضربان
+    نمی‌زند (crash یا kill) تمام‌شده با خطا حساب می‌کنند، نه در حال اجرا.
+    """
+
+    def __init__(self, process_id: str = PROCESS_ID, interval: float = HEARTBEAT_INTERVAL):
+        self.process_id = process_id
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        # ضربان اول قبل از پذیرش هر کاری ثبت می‌شود
+        await db.beat(self.process_id)
+        self._task = asyncio.create_task(self._beat())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await db.beat(self.process_id)
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await db.forget_process(self.process_id)
@@ -1,34 +1,60 @@
 import os
+import math
 import random
 import asyncio
 import logging
-import sqlite3
-import requests
+import json
+import time
 import base64
+import hashlib
+import weakref
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse, Response
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import CommandStart, Command
-from aiogram.types import WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup, BufferedInputFile
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.types import WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup, BufferedInputFile, InputMediaPhoto, InlineQueryResultCachedPhoto
 from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont
-import io
 from datetime import datetime
 
+# ماژول‌های داخلی تنظیماتشان را موقع import از محیط می‌خوانند، پس .env باید قبل از آن‌ها لود شود
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+import jobs
+from jobs import MintQueue, MINT_DEDUP_WINDOW
+import hf_client
+import render
+import db
+import broadcast
+import uploads
+import base_pool
+import metrics
+import assets
+import storage
+import gallery
+from fsm import SQLiteStorage
+from leader import LeaderLock, Heartbeat
+from admission import Admission, Rejected
+from updates import UpdatePool, UpdateCapture, HandlerTimer
+from users import KnownUsers, referrer_id
+
+logging.basicConfig(level=logging.INFO, format=metrics.LOG_FORMAT)
+metrics.install_log_filter()
 logger = logging.getLogger(__name__)
 
 # --- تنظیمات ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 HF_API_TOKEN = os.getenv("HF_API_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+# تعداد پروسه‌های uvicorn (همان متغیری که uvicorn خودش می‌خواند)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# برای سرور محلی Bot API یا stub تست بار
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN missing!")
@@ -36,41 +62,18 @@ if not BOT_TOKEN:
 if not HF_API_TOKEN:
     logger.warning("HF_API_TOKEN missing - AI image generation disabled (fallback used)")
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+# حالت FSM در SQLite تا مراحل پنل ادمین بین workerها گم نشود
+dp = Dispatcher(storage=SQLiteStorage())
 
-WEBAPP_URL = "https://the-void-1.onrender.com"
+WEBAPP_URL = os.getenv("WEBAPP_URL", "https://the-void-1.onrender.com").rstrip("/")
 HF_MODEL = "stabilityai/stable-diffusion-xl-base-1.0"
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
-OUTPUT_DIR = os.path.join(STATIC_DIR, "outputs")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# --- دیتابیس ---
-def init_db():
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS users (
-                 id INTEGER PRIMARY KEY,
-                 username TEXT,
-                 refs INTEGER DEFAULT 0,
-                 free_mints INTEGER DEFAULT 3,
-                 total_ascensions INTEGER DEFAULT 0
-              )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS ascensions (
-                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 user_id INTEGER,
-                 plan TEXT,
-                 burden TEXT,
-                 dna INTEGER,
-                 image_url TEXT,
-                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-              )""")
-    conn.commit()
-    conn.close()
-
-init_db()
 
 # --- پیام خوش‌آمدگویی ---
 WELCOME_MESSAGE = (
@@ -91,19 +94,14 @@ WELCOME_MESSAGE = (
 )
 
 @dp.message(CommandStart())
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, command: CommandObject = None):
     user_id = message.from_user.id
     username = message.from_user.username or message.from_user.first_name or "Unknown"
     
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-    if not c.fetchone():
-        c.execute("INSERT INTO users (id, username) VALUES (?, ?)", (user_id, username))
-        conn.commit()
-    conn.close()
+    # کاربر تکراری از کش جواب می‌گیرد؛ کاربر تازه در دسته‌ی بعدی insert ثبت می‌شود
+    known_users.ensure(user_id, username, referrer_id(command.args if command else None, user_id))
     
-    bot_username = (await bot.get_me()).username
+    bot_username = (await bot.me()).username
     ref_link = f"https://t.me/{bot_username}?start={user_id}"
     story_link = f"https://t.me/{bot_username}?startapp={user_id}"
     
@@ -117,95 +115,104 @@ async def cmd_start(message: types.Message):
     await message.answer(full_msg, parse_mode=ParseMode.HTML, reply_markup=kb)
 
 # --- تولید تصویر با Hugging Face ---
-async def generate_ai_image(prompt: str, init_image_base64: str = None):
+async def generate_ai_image(prompt: str, init_image: bytes = None):
     if not HF_API_TOKEN:
         return None
-    API_URL = f"https://api-inference.huggingface.co/models/{HF_MODEL}"
-    headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
+    API_URL = f"{hf_client.HF_API_BASE}/models/{HF_MODEL}"
     payload = {
         "inputs": prompt,
         "parameters": {
-            "strength": 0.4 if init_image_base64 else 0.0,
+            "strength": 0.4 if init_image else 0.0,
             "guidance_scale": 8.5,
             "num_inference_steps": 50
         }
     }
-    if init_image_base64:
-        payload["init_image"] = init_image_base64
-    
-    try:
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=90)
-        if response.status_code == 200:
-            return response.content
-        logger.error(f"HF API Error: {response.status_code} - {response.text}")
-    except Exception as e:
-        logger.error(f"HF Request failed: {e}")
-    return None
+    if init_image:
+        # base64 فقط همین‌جا و روی عکس کوچک‌شده ساخته می‌شود
+        payload["init_image"] = base64.b64encode(init_image).decode('utf-8')
+    
+    return await hf_client.inference(API_URL, payload)
+
+# --- ارسال گواهی ---
+def certificate_caption(plan: str, burden: str, dna) -> str:
+    return (f"🌌 <b>Your {plan.upper()} Ascension is complete!</b>\n\n"
+            f"Burden: {burden}\n"
+            f"DNA: <code>{dna}</code>\n\n"
+            f"The Void has claimed you forever.")
+
+async def send_certificate(chat_id: int, ascension: dict, image_bytes: bytes = None):
+    """ارسال گواهی؛ اگر file_id داشته باشد بدون آپلود دوباره فرستاده می‌شود"""
+    photo = ascension["file_id"]
+    if not photo:
+        if image_bytes is None:
+            image_bytes = await storage.load(ascension["image_url"])
+        photo = BufferedInputFile(image_bytes, filename="ascension.jpg")
+    msg = await bot.send_photo(
+        chat_id=chat_id,
+        photo=photo,
+        caption=certificate_caption(ascension["plan"], ascension["burden"], ascension["dna"]),
+        parse_mode=ParseMode.HTML
+    )
+    if not ascension["file_id"] and msg.photo:
+        ascension["file_id"] = msg.photo[-1].file_id
+        await db.set_file_id(ascension["id"], ascension["file_id"])
+    return msg
 
 # --- تابع مینت اصلی ---
-async def manual_mint(user_id: int, plan: str, burden: str = "Emperor's Gift", photo_base64: str = None):
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    
+async def manual_mint(user_id: int, plan: str, burden: str = "Emperor's Gift", photo: bytes = None):
     prompt = "luxurious dark royal portrait certificate with ornate golden arabesque frame, intricate diamonds and jewels, cosmic nebula background, sacred geometry mandala, elegant ancient gold font, ultra-detailed masterpiece cinematic lighting, 8K quality"
     
+    stage = metrics.mint_stage_seconds.time
     image_bytes = None
-    if photo_base64:
-        image_bytes = await generate_ai_image(prompt, photo_base64)
+    jobs.report("generating")
+    if photo:
+        with stage(stage="hf"):
+            image_bytes = await generate_ai_image(prompt, photo)
+        metrics.mint_image_source.inc(source="ai" if image_bytes else "ai_failed")
     
-    if not image_bytes:
-        # Fallback لوکس با Pillow
-        img = Image.new('RGB', (1000, 1400), (5, 5, 5))
-        draw = ImageDraw.Draw(img)
-        draw.rectangle([50, 50, 950, 1350], outline=(212, 175, 55), width=15)
-        draw.rectangle([70, 70, 930, 1330], outline=(169, 135, 0), width=5)
-        try:
-            font = ImageFont.truetype("arial.ttf", 80)
-            font_small = ImageFont.truetype("arial.ttf", 60)
-        except:
-            font = ImageFont.load_default(size=80)
-            font_small = ImageFont.load_default(size=60)
-        
-        draw.text((500, 200), "THE VOID", fill=(255, 215, 0), font=font, anchor="mm")
-        draw.text((500, 400), f"{plan.upper()} ASCENSION", fill=(212, 175, 55), font=font, anchor="mm")
-        draw.text((500, 700), f"Burden: {burden}", fill=(240, 240, 240), font=font_small, anchor="mm")
-        dna = random.randint(1000000, 9999999)
-        draw.text((500, 900), f"DNA: {dna}", fill=(169, 135, 0), font=font_small, anchor="mm")
-        draw.text((500, 1100), "Forever consumed by The Void", fill=(100, 100, 100), font=font_small, anchor="mm")
-        
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG")
-        image_bytes = buffer.getvalue()
-    
-    filename = f"{plan}_{user_id}_{random.randint(1000000,9999999)}.jpg"
-    filepath = os.path.join(OUTPUT_DIR, filename)
-    with open(filepath, "wb") as f:
-        f.write(image_bytes)
-    
-    image_url = f"/static/outputs/{filename}"
     dna = random.randint(1000000, 9999999)
-    
-    c.execute("INSERT INTO ascensions (user_id, plan, burden, dna, image_url) VALUES (?, ?, ?, ?, ?)",
-              (user_id, plan, burden, dna, image_url))
-    c.execute("UPDATE users SET total_ascensions = total_ascensions + 1 WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
-    
+    jobs.report("rendering")
+    if not image_bytes:
+        # بدون عکس همیشه قالب لوکس Pillow (بدون وابستگی به HF)؛ با عکس فقط اگر AI جواب نداد
+        metrics.mint_image_source.inc(source="fallback")
+        with stage(stage="render"):
+            image_bytes = await render.run(render.render_fallback, plan, burden, dna)
+    
+    # نسخه‌های سبک گالری (thumbnail و WebP) هم در process pool ساخته می‌شوند
+    with stage(stage="variants"):
+        thumb_bytes, webp_bytes = await render.run(render.render_variants, image_bytes)
+    
+    # هش محتوا در نام فایل: URL هر گواهی تغییرناپذیر است و با کش immutable سرو می‌شود
+    name = f"{plan}_{user_id}_{assets.content_hash(image_bytes)}"
+    files, urls = [], []
+    with stage(stage="write"):
+        for filename, data, content_type in ((f"{name}.jpg", image_bytes, "image/jpeg"),
+                                             (f"{name}_thumb.webp", thumb_bytes, "image/webp"),
+                                             (f"{name}.webp", webp_bytes, "image/webp")):
+            key, url = await storage.save(filename, data, content_type)
+            files.append((key, len(data)))
+            urls.append(url)
+    image_url, thumb_url, webp_url = urls
+    
+    with stage(stage="db"):
+        # کش گالری بعد از commit باطل می‌شود؛ با write-behind خواندن قبل از commit هنوز صفحه‌ی قدیمی را می‌بیند
+        ascension_id = await db.record_ascension(user_id, plan, burden, dna, image_url, thumb_url, webp_url, files,
+                                                 on_commit=lambda: gallery.cache.invalidate(user_id))
+    ascension = {"id": ascension_id, "user_id": user_id, "plan": plan, "burden": burden,
+                 "dna": dna, "image_url": image_url, "file_id": None}
+    result = {"id": ascension_id, "image_url": image_url, "thumb_url": thumb_url, "webp_url": webp_url, "dna": dna}
+    jobs.report("saved", **result)
+    
+    # رویداد delivered را خود صف با همین نتیجه می‌فرستد
+    result["sent"] = False
     try:
-        photo_file = BufferedInputFile(image_bytes, filename="ascension.jpg")
-        await bot.send_photo(
-            chat_id=user_id,
-            photo=photo_file,
-            caption=f"🌌 <b>Your {plan.upper()} Ascension is complete!</b>\n\n"
-                    f"Burden: {burden}\n"
-                    f"DNA: <code>{dna}</code>\n\n"
-                    f"The Void has claimed you forever.",
-            parse_mode=ParseMode.HTML
-        )
+        with stage(stage="send"):
+            await send_certificate(user_id, ascension, image_bytes)
+        result["sent"] = True
     except Exception as e:
         logger.error(f"Failed to send photo to {user_id}: {e}")
     
-    return image_url, dna
+    return result
 
 # --- پنل ادمین کامل و حرفه‌ای ---
 class AdminStates(StatesGroup):
@@ -220,26 +227,12 @@ async def cmd_admin(message: types.Message):
         return await message.answer("⚠️ The Void recognizes only its true Emperor.")
     
     # جمع‌آوری آمار کامل
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    
-    c.execute("SELECT COUNT(*) FROM users")
-    total_users = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM ascensions")
-    total_ascensions = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM ascensions WHERE plan != 'eternal'")
-    paid_ascensions = c.fetchone()[0]
-    
-    c.execute("SELECT SUM(free_mints) FROM users")
-    remaining_free = c.fetchone()[0] or 0
-    
-    today = datetime.now().strftime("%Y-%m-%d")
-    c.execute("SELECT COUNT(*) FROM ascensions WHERE date(timestamp) = ?", (today,))
-    today_ascensions = c.fetchone()[0]
-    
-    conn.close()
+    stats = await db.admin_stats()
+    total_users = stats["total_users"]
+    total_ascensions = stats["total_ascensions"]
+    paid_ascensions = stats["paid_ascensions"]
+    remaining_free = stats["remaining_free"]
+    today_ascensions = stats["today_ascensions"]
     
     stats_text = f"""
 🔱 <b>Emperor's Void Control Panel</b> 🔱
@@ -313,31 +306,47 @@ async def admin_mint_execute(message: types.Message, state: FSMContext):
     data = await state.get_data()
     target_id = data['target_id']
     plan = data['plan']
-    photo_base64 = None
+    photo = None
     
     if message.photo:
         file_id = message.photo[-1].file_id
         file = await bot.get_file(file_id)
         photo_bytes = await bot.download_file(file.file_path)
-        photo_base64 = base64.b64encode(photo_bytes.read()).decode('utf-8')
+        photo = await render.run(render.prepare_photo, photo_bytes.getvalue())
     elif message.text and message.text.lower() == "/skip":
-        photo_base64 = None
+        photo = None
     else:
         return await message.answer("Send photo or /skip.")
     
-    await manual_mint(target_id, plan, "Emperor's Gift", photo_base64)
-    await message.answer(f"✅ {plan} granted to {target_id}!")
+    # مینت در صف اجرا می‌شود تا worker آپدیت‌ها برای چت‌های دیگر آزاد بماند
+    try:
+        await mint_queue.submit(gift_mint, message.chat.id, target_id, plan, photo)
+    except asyncio.QueueFull:
+        return await message.answer("⏳ Mint queue is full. Send photo or /skip again shortly.")
+    await message.answer(f"⏳ {plan} for {target_id} queued.")
     await state.clear()
 
+async def gift_mint(admin_chat_id: int, target_id: int, plan: str, photo: bytes = None):
+    """مینت هدیه‌ی ادمین در صف؛ نتیجه بعد از اتمام به ادمین گزارش می‌شود"""
+    try:
+        result = await manual_mint(target_id, plan, "Emperor's Gift", photo)
+    except Exception:
+        await notify_admin(admin_chat_id, f"❌ {plan} for {target_id} failed.")
+        raise
+    await notify_admin(admin_chat_id, f"✅ {plan} granted to {target_id}!")
+    return result
+
+async def notify_admin(chat_id: int, text: str):
+    try:
+        await bot.send_message(chat_id, text)
+    except Exception as e:
+        logger.warning(f"Admin notification failed: {e}")
+
 @dp.callback_query(lambda c: c.data == "admin_reset_all")
 async def admin_reset_all(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         return
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    c.execute("UPDATE users SET free_mints = 3")
-    conn.commit()
-    conn.close()
+    await db.reset_free_mints()
     await callback.message.answer("🔄 All free mints reset!")
     await callback.answer()
 
@@ -353,33 +362,17 @@ async def admin_broadcast_send(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID:
         return
     
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    c.execute("SELECT id FROM users")
-    users = [row[0] for row in c.fetchall()]
-    conn.close()
-    
-    success = 0
-    for uid in users:
-        try:
-            await message.forward(uid)
-            success += 1
-            await asyncio.sleep(0.05)
-        except:
-            pass
-    
-    await message.answer(f"📢 Broadcast sent to {success}/{len(users)} users.")
+    status = await message.answer("📢 Broadcast queued...")
+    broadcast_id = await db.create_broadcast(message.chat.id, message.message_id, status.chat.id, status.message_id,
+                                             heartbeat.process_id)
+    broadcast.start(bot, broadcast_id)
     await state.clear()
 
 @dp.callback_query(lambda c: c.data == "admin_last_asc")
 async def admin_last_asc(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         return
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    c.execute("SELECT user_id, plan, burden, dna, timestamp FROM ascensions ORDER BY timestamp DESC LIMIT 20")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.last_ascensions(20)
     
     if not rows:
         return await callback.message.answer("No ascensions yet.")
@@ -389,16 +382,19 @@ async def admin_last_asc(callback: types.CallbackQuery):
         text += f"• {row[1]} | {row[2][:20]} | User_{str(row[0])[-4:]} | DNA: {row[3]} | {row[4][:16]}\n"
     
     await callback.message.answer(text)
+    
+    # پیش‌نمایش با file_id؛ هیچ تصویری دوباره آپلود نمی‌شود
+    previews = [row[5] for row in rows if row[5]][:10]
+    if len(previews) == 1:
+        await callback.message.answer_photo(previews[0])
+    elif previews:
+        await callback.message.answer_media_group([InputMediaPhoto(media=file_id) for file_id in previews])
 
 @dp.callback_query(lambda c: c.data == "admin_top_users")
 async def admin_top_users(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         return
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    c.execute("SELECT id, username, total_ascensions FROM users ORDER BY total_ascensions DESC LIMIT 10")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.top_users(10)
     
     text = "🏆 Top 10 Active Users:\n\n"
     for i, row in enumerate(rows, 1):
@@ -406,40 +402,221 @@ async def admin_top_users(callback: types.CallbackQuery):
     
     await callback.message.answer(text)
 
+@dp.inline_query()
+async def inline_share(query: types.InlineQuery):
+    # اشتراک گواهی‌ها در هر چتی با @bot؛ فقط file_id فرستاده می‌شود
+    rows = await db.recent_file_ids(query.from_user.id, 20)
+    results = [
+        InlineQueryResultCachedPhoto(
+            id=str(row[0]),
+            photo_file_id=row[4],
+            caption=f"🌌 <b>{row[1].upper()} Ascension</b>\nBurden: {row[2]}\nDNA: <code>{row[3]}</code>",
+            parse_mode=ParseMode.HTML
+        )
+        for row in rows
+    ]
+    await query.answer(results, cache_time=60, is_personal=True)
+
 # --- ثبت هندلرها ---
 dp.message.register(cmd_start, CommandStart())
 dp.message.register(cmd_admin, Command("admin"))
+handler_timer = HandlerTimer()
+handler_timer.install(dp)
+
+# --- صف مینت ---
+mint_queue = MintQueue()
+leader = LeaderLock()
+heartbeat = Heartbeat()
+admission = Admission(mint_queue)
+update_pool = UpdatePool(dp, bot)
+capture = UpdateCapture()
+known_users = KnownUsers()
+
+metrics.Gauge("void_mint_queue_depth", "Mint jobs waiting for a worker", lambda: mint_queue.queue.qsize())
+metrics.Gauge("void_mint_inflight", "Mints admitted and not yet finished", admission.inflight)
+metrics.Gauge("void_update_queue_depth", "Telegram updates waiting for a worker", update_pool.depth)
+metrics.Gauge("void_hf_breaker_open", "1 while the HF circuit breaker rejects calls", lambda: int(hf_client.breaker.state == "open"))
 
 # --- FastAPI ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    await bot.delete_webhook(drop_pending_updates=True)
-    webhook_url = "https://the-void-1.onrender.com/webhook"
+async def lead(at_startup: bool):
+    """کارهای یک‌باره‌ی سراسری؛ فقط در پروسه‌ای که قفل رهبری را دارد"""
+    if at_startup:
+        # با جایگزینی رهبر وسط کار، آپدیت‌های در انتظار نباید دور ریخته شوند
+        await bot.delete_webhook(drop_pending_updates=True)
+    webhook_url = f"{WEBAPP_URL}/webhook"
     await bot.set_webhook(url=webhook_url)
     logger.info(f"Webhook set to {webhook_url}")
+    base_pool.start()
+    storage.start()
+    broadcast.watch(bot)
+    mint_queue.sweep_orphans()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    render.start()
+    # امن برای چند worker هم‌زمان: مهاجرت‌ها پشت قفل نوشتن SQLite اجرا می‌شوند
+    await asyncio.to_thread(db.init_db)
+    await known_users.warm()
+    # هویت بات یک بار گرفته و در bot.me() کش می‌شود
+    me = await bot.me()
+    logger.info(f"Running as @{me.username}")
+    # کارهای مینت این پروسه فقط تا وقتی ضربان ثبت می‌شود در حال اجرا حساب می‌شوند
+    await heartbeat.start()
+    update_pool.start()
+    mint_queue.start()
+    leader.start(lead)
     yield
-    await bot.delete_webhook()
+    await leader.stop()
+    await update_pool.stop()
+    capture.close()
+    await base_pool.stop()
+    await storage.stop()
+    await broadcast.stop()
+    await mint_queue.stop()
+    await hf_client.close()
+    render.shutdown()
+    await known_users.stop()
+    await heartbeat.stop()
+    db.close()
+    # با چند worker بقیه هنوز سرو می‌کنند و وبهوک باید بماند
+    if leader.is_leader and WEB_CONCURRENCY == 1:
+        await bot.delete_webhook()
+    leader.release()
     await bot.session.close()
 
 app = FastAPI(lifespan=lifespan)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+if isinstance(storage.backend, storage.LocalBackend):
+    # گواهی‌ها ممکن است خارج از static باشند (STORAGE_DIR)؛ این mount باید قبل از /static بیاید
+    app.mount(storage.STORAGE_URL_PREFIX, assets.CachedStaticFiles(directory=storage.backend.root), name="outputs")
+static_files = assets.CachedStaticFiles(directory=STATIC_DIR)
+app.mount("/static", static_files, name="static")
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    # trace id از هدر X-Request-ID یا تازه ساخته می‌شود و در پاسخ برمی‌گردد
+    trace = metrics.new_trace(request.headers.get("x-request-id"))
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = trace
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.http_request_seconds.observe(time.perf_counter() - start,
+                                             route=route.path if route else "other",
+                                             method=request.method, status=status)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/", response_class=HTMLResponse)
-async def home():
-    path = os.path.join(STATIC_DIR, "index.html")
-    if os.path.exists(path):
-        return FileResponse(path)
+async def home(request: Request):
+    # index.html از حافظه و فشرده سرو می‌شود؛ باز کردن دوباره فقط یک 304 است
+    response = static_files.asset_response("index.html", request.headers)
+    if response is not None:
+        return response
     return "<h1>🌌 THE VOID</h1><p>index.html missing</p>"
 
 @app.post("/webhook")
 async def webhook(request: Request):
     try:
-        update = types.Update(**await request.json())
-        await dp.feed_update(bot=bot, update=update)
+        raw = await request.json()
+        update = types.Update(**raw)
+        await update_pool.submit(update)
+        capture.write(raw)
     except Exception as e:
         logger.error(f"Webhook error: {e}")
     return {"ok": True}
 
+# درخواست‌های هم‌کلید پشت یک قفل پذیرش می‌شوند؛ قفل بعد از آخرین درخواست خودش آزاد می‌شود
+_mint_locks = weakref.WeakValueDictionary()
+
+async def mint_key(user_id, plan: str, burden: str, photo: uploads.SpooledPhoto = None, header: str = None) -> str:
+    """کلید idempotency: هدر کلاینت، یا هش کاربر/پلن/بار/عکس"""
+    if header:
+        return f"{user_id}:{header[:128]}"
+    digest = hashlib.sha256(f"{user_id}|{plan}|{burden}|".encode())
+    # هش خود عکس از قبل (هنگام آپلود) یا بیرون از event loop ساخته می‌شود
+    if photo:
+        digest.update((await photo.digest()).encode())
+    return f"{user_id}:~{digest.hexdigest()}"
+
+def queued_response(job: dict, status_code: int = 202):
+    return JSONResponse({
+        "status": "queued" if status_code == 202 else job["status"],
+        "job_id": job["id"],
+        "status_url": f"/api/mint/{job['id']}",
+        "events_url": f"/api/mint/{job['id']}/events"
+    }, status_code=status_code)
+
+async def enqueue_mint(user_id, plan: str, burden: str, photo: uploads.SpooledPhoto = None,
+                       idempotency_key: str = None):
+    if not user_id:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    
+    key = await mint_key(user_id, plan, burden, photo, idempotency_key)
+    lock = _mint_locks.setdefault(key, asyncio.Lock())
+    window = None if idempotency_key else MINT_DEDUP_WINDOW
+    async with lock:
+        # تپ دوباره یا retry شبکه: همان کار قبلی (در حال اجرا یا تمام‌شده) برگردانده می‌شود
+        job = await mint_queue.find(key, window)
+        if job is None:
+            # قفل بالا فقط همین پروسه را پوشش می‌دهد؛ بین workerها کلید در SQLite ادعا می‌شود
+            job_id, job = await mint_queue.claim(key, window)
+        if job:
+            metrics.mint_deduplicated.inc()
+            return queued_response(job, status_code=200)
+        response = None
+        try:
+            with admission.admit(user_id):
+                response = await admit_mint(user_id, plan, burden, photo, key, job_id)
+        except Rejected as e:
+            return JSONResponse({"error": e.message}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+        finally:
+            if response is None or response.status_code != 202:
+                await mint_queue.release(job_id)
+        # سهم نرخ کاربر فقط برای مینتی مصرف می‌شود که واقعاً در صف رفت
+        if response.status_code != 202:
+            admission.refund(user_id)
+        return response
+
+def overwhelmed():
+    """503 صف پر؛ کلاینت بعد از زمان انتظار تخمینی صف دوباره تلاش می‌کند"""
+    retry_after = max(1, math.ceil(mint_queue.estimated_wait()))
+    return JSONResponse({"error": "The Void is overwhelmed. Try again soon."}, status_code=503,
+                        headers={"Retry-After": str(retry_after)})
+
+async def admit_mint(user_id, plan: str, burden: str, upload: uploads.SpooledPhoto, key: str, job_id: str):
+    if mint_queue.queue.full():
+        return overwhelmed()
+    
+    photo = None
+    if upload:
+        try:
+            photo = await render.run(render.prepare_photo, upload.source())
+        except Exception:
+            return JSONResponse({"error": "Invalid photo"}, status_code=400)
+    
+    free = plan == 'Eternal'
+    if free:
+        # کاربری که همین الان /start زده ممکن است هنوز در صف insert باشد
+        await known_users.settle(user_id)
+        if not await db.take_free_mint(user_id):
+            return JSONResponse({"error": "No free mints left"}, status_code=403)
+    
+    try:
+        await mint_queue.submit(manual_mint, user_id, plan, burden, photo, key=key,
+                                refund_user=user_id if free else None, job_id=job_id)
+    except asyncio.QueueFull:
+        # صف در فاصله‌ی آماده‌سازی عکس پر شد؛ مینت رایگان گرفته‌شده برمی‌گردد
+        if free:
+            await db.refund_free_mint(user_id)
+        return overwhelmed()
+    return queued_response(await mint_queue.get(job_id))
+
 @app.post("/api/mint")
 async def api_mint(request: Request):
     try:
@@ -447,46 +624,107 @@ async def api_mint(request: Request):
         user_id = data.get('u')
         plan = data.get('plan', 'eternal').capitalize()
         burden = data.get('b', 'Unknown Burden')
-        photo_base64 = data.get('p')
-        
-        if not user_id:
-            return JSONResponse({"error": "Unauthorized"}, status_code=401)
-        
-        conn = sqlite3.connect("void_data.db")
-        c = conn.cursor()
-        c.execute("SELECT free_mints FROM users WHERE id = ?", (user_id,))
-        row = c.fetchone()
-        
-        if plan == 'Eternal' and (not row or row[0] <= 0):
-            conn.close()
-            return JSONResponse({"error": "No free mints left"}, status_code=403)
-        
-        if plan == 'Eternal' and row and row[0] > 0:
-            c.execute("UPDATE users SET free_mints = free_mints - 1 WHERE id = ?", (user_id,))
-            conn.commit()
-        
-        conn.close()
-        
-        image_url, dna = await manual_mint(user_id, plan, burden, photo_base64)
-        return JSONResponse({
-            "status": "success",
-            "message": "Ascension complete!",
-            "image_url": image_url,
-            "dna": dna
-        })
+        photo = uploads.SpooledPhoto.from_bytes(uploads.decode_base64_photo(data['p'])) if data.get('p') else None
+        return await enqueue_mint(user_id, plan, burden, photo, request.headers.get("idempotency-key"))
+    except uploads.UploadError as e:
+        return JSONResponse({"error": e.message}, status_code=e.status_code)
     except Exception as e:
         logger.error(f"Mint error: {e}")
         return JSONResponse({"error": "The Void is restless."}, status_code=500)
 
+@app.post("/api/mint/upload")
+async def api_mint_upload(request: Request):
+    # مسیر multipart: عکس جریانی در فایل موقت نوشته می‌شود، بدون base64
+    try:
+        fields, photo = await uploads.read_mint_form(request)
+        # فایل موقت تا پایان آماده‌سازی عکس در process pool باز می‌ماند
+        try:
+            user_id = int(fields['u']) if fields.get('u', '').isdigit() else None
+            plan = fields.get('plan', 'eternal').capitalize()
+            burden = fields.get('b', 'Unknown Burden')
+            return await enqueue_mint(user_id, plan, burden, photo, request.headers.get("idempotency-key"))
+        finally:
+            if photo is not None:
+                photo.close()
+    except uploads.UploadError as e:
+        return JSONResponse({"error": e.message}, status_code=e.status_code)
+    except Exception as e:
+        logger.error(f"Mint upload error: {e}")
+        return JSONResponse({"error": "The Void is restless."}, status_code=500)
+
+@app.get("/api/mint/{job_id}")
+async def get_mint_status(job_id: str):
+    job = await mint_queue.get(job_id)
+    if not job:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    body = {"job_id": job_id, "status": job["status"]}
+    if job["status"] == "success":
+        body.update(job["result"])
+        body["message"] = "Ascension complete!"
+    elif job["status"] == "failed":
+        body["error"] = job["error"]
+    return JSONResponse(body)
+
+# کامنت keepalive تا proxyها اتصال بی‌کار را نبندند
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))
+
+@app.get("/api/mint/{job_id}/events")
+async def stream_mint_events(job_id: str):
+    # Server-Sent Events: queued → generating → rendering → saved → delivered (یا failed)
+    if not await mint_queue.get(job_id):
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    
+    async def stream():
+        async for event in mint_queue.events(job_id, SSE_KEEPALIVE):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                name, data = event
+                yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+GALLERY_PAGE_SIZE = 30
+GALLERY_MAX_PAGE_SIZE = 100
+
 @app.get("/api/gallery/{user_id}")
-async def get_gallery(user_id: int):
-    conn = sqlite3.connect("void_data.db")
-    c = conn.cursor()
-    c.execute("SELECT image_url, plan, dna, burden FROM ascensions WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
-    items = [{"image": row[0], "plan": row[1], "dna": row[2], "burden": row[3]} for row in c.fetchall()]
-    conn.close()
-    return JSONResponse(items)
+async def get_gallery(user_id: int, request: Request, limit: int = GALLERY_PAGE_SIZE, cursor: str = None):
+    limit = max(1, min(limit, GALLERY_MAX_PAGE_SIZE))
+    key = (user_id, limit, cursor)
+    # باز کردن دوباره‌ی وب‌اپ: بدنه‌ی آماده از کش، یا فقط 304 اگر کلاینت همان نسخه را دارد
+    cached = gallery.cache.get(key)
+    if cached is None:
+        try:
+            position = db.decode_cursor(cursor) if cursor else None
+        except ValueError:
+            return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+        generation = gallery.cache.generation(user_id)
+        rows, next_cursor = await db.gallery(user_id, limit, position)
+        # نسخه‌های کامل ممکن است با نگهداری حذف شده باشند؛ thumbnail همیشه می‌ماند
+        items = [{"id": row[0], "image": row[1] or row[6], "thumb": row[6] or row[1],
+                  "webp": row[7] or row[1] or row[6], "plan": row[2], "dna": row[3], "burden": row[4]}
+                 for row in rows]
+        cached = gallery.cache.put(key, gallery.dumps({"items": items, "next_cursor": next_cursor}), generation)
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if assets.etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.post("/api/ascensions/{ascension_id}/resend")
+async def resend_ascension(ascension_id: int, request: Request):
+    try:
+        data = await request.json()
+        ascension = await db.get_ascension(ascension_id)
+        if not ascension or str(ascension["user_id"]) != str(data.get('u')):
+            return JSONResponse({"error": "Unknown ascension"}, status_code=404)
+        await send_certificate(ascension["user_id"], ascension)
+        return JSONResponse({"status": "success"})
+    except Exception as e:
+        logger.error(f"Resend error: {e}")
+        return JSONResponse({"error": "The Void is restless."}, status_code=500)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", 8000)), workers=WEB_CONCURRENCY)
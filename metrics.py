@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# --- تنظیمات متریک و trace ---
+TRACE_IDS = os.getenv("TRACE_IDS", "0") == "1"
+LOG_FORMAT = "%(levelname)s:%(name)s:[%(trace_id)s] %(message)s" if TRACE_IDS else logging.BASIC_FORMAT
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# متریک‌ها در حافظه‌ی همین پروسه نگه داشته می‌شوند و با فرمت متنی Prometheus خروجی می‌گیرند؛
+# observe از threadهای دیتابیس هم صدا زده می‌شود، برای همین هر متریک قفل خودش را دارد
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for key, value in self.values.items():
+                yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+
+class Gauge:
+    """مقدار لحظه‌ای که هنگام scrape از callback خوانده می‌شود"""
+
+    def __init__(self, name: str, help: str, fn=None):
+        self.name, self.help, self.fn = name, help, fn
+        _registry.append(self)
+
+    def collect(self):
+        if self.fn is None:
+            return
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry[0][i] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, n in zip(self.buckets, counts):
+                    yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (bound,))} {n}"
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + ('+Inf',))} {count}"
+                yield f"{self.name}_sum{_labels(self.labelnames, key)} {total}"
+                yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+def render() -> str:
+    """خروجی متنی همه‌ی متریک‌ها برای /metrics"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# --- متریک‌های پایپ‌لاین ---
+http_request_seconds = Histogram("void_http_request_seconds", "HTTP request latency", ("route", "method", "status"))
+mint_stage_seconds = Histogram("void_mint_stage_seconds", "Latency of each manual_mint stage", ("stage",))
+mint_job_seconds = Histogram("void_mint_job_seconds", "Mint job runtime in the queue worker", ("status",))
+mint_queue_wait_seconds = Histogram("void_mint_queue_wait_seconds", "Time a mint job waited before a worker picked it up")
+mint_deduplicated = Counter("void_mint_deduplicated_total", "Mint requests answered with an existing job")
+mint_rejected = Counter("void_mint_rejected_total", "Mint requests shed by admission control", ("reason",))
+mint_image_source = Counter("void_mint_image_source_total", "Where the certificate base image came from", ("source",))
+hf_requests = Counter("void_hf_requests_total", "HF inference attempts by outcome", ("outcome",))
+hf_request_seconds = Histogram("void_hf_request_seconds", "Latency of a single HF inference attempt")
+update_dispatch_seconds = Histogram("void_update_dispatch_seconds", "Dispatcher time per Telegram update", ("type",))
+known_user_lookups = Counter("void_known_user_lookups_total", "/start lookups in the known-user cache", ("result",))
+handler_seconds = Histogram("void_handler_seconds", "Time spent inside each bot handler", ("handler",))
+db_query_seconds = Histogram("void_db_query_seconds", "SQLite call time on the db threads", ("query", "mode"),
+                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+db_commit_seconds = Histogram("void_db_commit_seconds", "Time of one group commit on the writer thread",
+                              buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+db_commit_batch = Histogram("void_db_commit_batch", "Writes committed together in one transaction",
+                            buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+# --- trace id ---
+trace_id = contextvars.ContextVar("trace_id", default="-")
+
+
+def new_trace(value: str = None) -> str:
+    value = value or uuid.uuid4().hex[:16]
+    trace_id.set(value)
+    return value
+
+
+class TraceFilter(logging.Filter):
+    """trace id درخواست جاری را به هر رکورد لاگ اضافه می‌کند"""
+
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+def install_log_filter():
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceFilter())
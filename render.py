@@ -0,0 +1,144 @@
+import os
+import io
+import asyncio
+import logging
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات رندر ---
+# با چند worker وب، هسته‌ها بین process poolهای آن‌ها تقسیم می‌شوند
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))))))
+THUMB_WIDTH = int(os.getenv("THUMB_WIDTH", "320"))
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "70"))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE", "1024"))
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "font.ttf")
+
+_pool = None
+
+
+def start():
+    """ساخت process pool؛ باید زود و قبل از ساخت threadهای دیگر صدا زده شود"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+        # با fork همه‌ی workerها در اولین submit ساخته می‌شوند
+        _pool.submit(_warmup).result()
+        logger.info(f"Render pool started with {RENDER_WORKERS} processes")
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+async def run(fn, *args):
+    """اجرای یک تابع رندر در process pool بدون بلاک کردن event loop"""
+    if _pool is None:
+        start()
+    return await asyncio.get_running_loop().run_in_executor(_pool, fn, *args)
+
+
+def _warmup():
+    return os.getpid()
+
+
+# --- کش فونت و قالب (هر پروسه‌ی worker کش خودش را دارد) ---
+@lru_cache(maxsize=32)
+def get_font(path: str, size: int):
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        logger.warning(f"Font {path} not found - using default font")
+        return ImageFont.load_default(size=size)
+
+
+@lru_cache(maxsize=16)
+def fallback_template(plan: str):
+    """قاب و متن‌های ثابت گواهی fallback؛ برای هر پلن فقط یک بار رسم می‌شود"""
+    img = Image.new('RGB', (1000, 1400), (5, 5, 5))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([50, 50, 950, 1350], outline=(212, 175, 55), width=15)
+    draw.rectangle([70, 70, 930, 1330], outline=(169, 135, 0), width=5)
+    font = get_font(FONT_PATH, 80)
+    font_small = get_font(FONT_PATH, 60)
+    draw.text((500, 200), "THE VOID", fill=(255, 215, 0), font=font, anchor="mm")
+    draw.text((500, 400), f"{plan.upper()} ASCENSION", fill=(212, 175, 55), font=font, anchor="mm")
+    draw.text((500, 1100), "Forever consumed by The Void", fill=(100, 100, 100), font=font_small, anchor="mm")
+    return img
+
+
+@lru_cache(maxsize=1)
+def certificate_overlay():
+    """لایه‌ی شفاف عنوان گواهی cert_gen"""
+    layer = Image.new('RGBA', (1000, 1414), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    draw.text((500, 150), "CERTIFICATE OF ASCENSION", fill="#D4AF37", font=get_font(FONT_PATH, 55), anchor="mm")
+    return layer
+
+
+# --- توابع رندر (داخل پروسه‌های worker اجرا می‌شوند) ---
+def render_fallback(plan: str, burden: str, dna: int) -> bytes:
+    """گواهی لوکس Pillow وقتی تصویر AI در دسترس نیست (JPEG)"""
+    img = fallback_template(plan).copy()
+    draw = ImageDraw.Draw(img)
+    font_small = get_font(FONT_PATH, 60)
+    draw.text((500, 700), f"Burden: {burden}", fill=(240, 240, 240), font=font_small, anchor="mm")
+    draw.text((500, 900), f"DNA: {dna}", fill=(169, 135, 0), font=font_small, anchor="mm")
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def render_certificate(image_bytes, burden: str, level: str, dna) -> bytes:
+    """گواهی روی تصویر AI یا زمینه‌ی رزرو؛ فقط متن‌های هر مینت رسم می‌شوند"""
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except:
+        # تصویر رزرو در صورت قطع بودن اینترنت
+        image = Image.new('RGB', (1000, 1414), color='#0a0a0a')
+
+    canvas = image.convert('RGB').resize((1000, 1414))
+    canvas.paste(certificate_overlay(), (0, 0), certificate_overlay())
+    draw = ImageDraw.Draw(canvas)
+    font_sub = get_font(FONT_PATH, 30)
+    draw.text((500, 700), f"'{burden}'", fill="white", font=font_sub, anchor="mm")
+    draw.text((500, 1250), f"DNA: {dna} | LEVEL: {level}", fill="#D4AF37", font=font_sub, anchor="mm")
+
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_variants(image_bytes: bytes):
+    """نسخه‌های سبک برای گالری: (thumbnail WebP، تصویر کامل WebP)"""
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+
+    full = io.BytesIO()
+    image.save(full, format="WEBP", quality=WEBP_QUALITY, method=4)
+
+    height = round(image.height * THUMB_WIDTH / image.width)
+    thumb = io.BytesIO()
+    image.resize((THUMB_WIDTH, height), Image.LANCZOS).save(thumb, format="WEBP", quality=THUMB_QUALITY, method=4)
+    return thumb.getvalue(), full.getvalue()
+
+
+def prepare_photo(source) -> bytes:
+    """عکس کاربر فقط یک بار و قبل از inference به اندازه‌ی ورودی مدل کوچک می‌شود (JPEG)
+
+    source: بایت‌های عکس یا مسیر فایل موقت آپلود؛ فایل همین‌جا در process pool باز می‌شود.
+    """
+    image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+    # برای JPEG، دیکد مستقیم در مقیاس کوچک‌تر انجام می‌شود
+    image.draft('RGB', (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
@@ -0,0 +1,233 @@
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import db
+import assets
+import gallery
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات ذخیره‌سازی خروجی‌ها ---
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_DIR = os.getenv("STORAGE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "outputs"))
+STORAGE_URL_PREFIX = "/static/outputs"
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL", "").rstrip("/")
+S3_REGION = os.getenv("S3_REGION") or None
+# نگهداری: 0 یعنی بدون محدودیت
+STORAGE_RETENTION_DAYS = float(os.getenv("STORAGE_RETENTION_DAYS", "0"))
+STORAGE_QUOTA_MB = float(os.getenv("STORAGE_QUOTA_MB", "0"))
+STORAGE_RETENTION_INTERVAL = float(os.getenv("STORAGE_RETENTION_INTERVAL", "3600"))
+STORAGE_RETENTION_BATCH = int(os.getenv("STORAGE_RETENTION_BATCH", "500"))
+
+
+def shard_key(name: str) -> str:
+    """ab/cd/name: دو سطح پوشه از هش نام تا هیچ پوشه‌ای بیش از چند صد فایل نگیرد"""
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+
+class LocalBackend:
+    """فایل‌ها زیر STORAGE_DIR و سرو شده با mount استاتیک"""
+
+    def __init__(self, root: str = STORAGE_DIR, url_prefix: str = STORAGE_URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, key: str, data: bytes, content_type: str):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # اول در فایل موقت، بعد rename؛ خواننده هیچ‌وقت فایل نیمه‌کاره نمی‌بیند
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+    def delete(self, key: str):
+        path = os.path.join(self.root, key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        # پوشه‌های شارد خالی هم جمع می‌شوند
+        parent = os.path.dirname(path)
+        while parent != self.root:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    def url(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def key_from_url(self, url: str) -> str:
+        return url[len(self.url_prefix) + 1:]
+
+
+class S3Backend:
+    """هر سرویس سازگار با S3 (MinIO، R2، ...)؛ boto3 فقط در این حالت لازم است"""
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: str = S3_ENDPOINT_URL,
+                 public_url: str = S3_PUBLIC_URL, region: str = S3_REGION):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 installed")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET missing!")
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.url_prefix = public_url or f"{(endpoint_url or 'https://s3.amazonaws.com').rstrip('/')}/{bucket}"
+
+    def put(self, key: str, data: bytes, content_type: str):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type,
+                               CacheControl=assets.IMMUTABLE_CACHE_CONTROL)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def key_from_url(self, url: str) -> str:
+        return url[len(self.url_prefix) + 1:]
+
+
+BACKENDS = {"local": LocalBackend, "s3": S3Backend}
+backend = BACKENDS[STORAGE_BACKEND]()
+_task = None
+
+
+async def save(name: str, data: bytes, content_type: str):
+    """ذخیره در مسیر شارد؛ (key, url) برمی‌گرداند"""
+    key = shard_key(name)
+    await asyncio.to_thread(backend.put, key, data, content_type)
+    return key, backend.url(key)
+
+
+async def load(url: str) -> bytes:
+    return await asyncio.to_thread(backend.get, backend.key_from_url(url))
+
+
+# --- نگهداری و فشرده‌سازی ---
+def _invalidate_galleries(users):
+    for user_id in users:
+        gallery.cache.invalidate(user_id)
+
+
+async def _delete(rows):
+    for key, _ in rows:
+        await asyncio.to_thread(backend.delete, key)
+    await db.forget_files([(key, backend.url(key)) for key, _ in rows], on_commit=_invalidate_galleries)
+    return sum(size for _, size in rows)
+
+
+async def enforce_retention() -> int:
+    """حذف فایل‌های منقضی و بعد قدیمی‌ترین‌ها تا زیر سهمیه؛ تعداد بایت آزادشده"""
+    freed = 0
+    if STORAGE_RETENTION_DAYS > 0:
+        cutoff = time.time() - STORAGE_RETENTION_DAYS * 86400
+        while rows := await db.retention_candidates(cutoff, STORAGE_RETENTION_BATCH):
+            freed += await _delete(rows)
+            if len(rows) < STORAGE_RETENTION_BATCH:
+                break
+    if STORAGE_QUOTA_MB > 0:
+        quota = STORAGE_QUOTA_MB * 1024 * 1024
+        while (used := await db.storage_bytes()) > quota:
+            rows = await db.retention_candidates(time.time(), STORAGE_RETENTION_BATCH)
+            if not rows:
+                logger.warning(f"Storage over quota ({used} bytes) but nothing is eligible for deletion")
+                break
+            # فقط به اندازه‌ی لازم، از قدیمی‌ترین
+            batch, excess = [], used - quota
+            for key, size in rows:
+                batch.append((key, size))
+                excess -= size
+                if excess <= 0:
+                    break
+            freed += await _delete(batch)
+    return freed
+
+
+def _legacy_files(limit: int):
+    with os.scandir(backend.root) as entries:
+        found = []
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                found.append((entry.name, entry.stat()))
+                if len(found) >= limit:
+                    break
+        return found
+
+
+def _relink(old: str, new: str):
+    os.makedirs(os.path.dirname(new), exist_ok=True)
+    try:
+        os.link(old, new)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(old, new)
+
+
+async def compact_legacy() -> int:
+    """فایل‌های قدیمی تخت در ریشه‌ی outputs به شاردها منتقل و فهرست می‌شوند"""
+    if not isinstance(backend, LocalBackend):
+        return 0
+    files = await asyncio.to_thread(_legacy_files, STORAGE_RETENTION_BATCH)
+    if not files:
+        return 0
+    owners = await db.url_owners()
+    for name, stat in files:
+        key = shard_key(name)
+        old_path, new_path = os.path.join(backend.root, name), os.path.join(backend.root, key)
+        # لینک جدید، بعد URL در دیتابیس، بعد حذف قدیمی: فایل هیچ لحظه‌ای از دسترس خارج نمی‌شود
+        await asyncio.to_thread(_relink, old_path, new_path)
+        old_url = backend.url(name)
+        await db.relocate_file(owners.get(old_url), old_url, backend.url(key), key, stat.st_size, stat.st_mtime)
+        await asyncio.to_thread(os.remove, old_path)
+    # URLهای گالری عوض شده‌اند
+    gallery.cache.clear()
+    logger.info(f"Moved {len(files)} legacy outputs into shards")
+    return len(files)
+
+
+async def _run():
+    while True:
+        try:
+            while await compact_legacy() >= STORAGE_RETENTION_BATCH:
+                pass
+            freed = await enforce_retention()
+            if freed:
+                logger.info(f"Storage retention freed {freed} bytes")
+        except Exception as e:
+            logger.error(f"Storage maintenance failed: {e}")
+        await asyncio.sleep(STORAGE_RETENTION_INTERVAL)
+
+
+def start():
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
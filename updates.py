@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from aiogram import BaseMiddleware
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات پردازش آپدیت‌ها ---
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "10"))
+# ضبط آپدیت‌های خام وبهوک برای bench/replay.py؛ خالی یعنی خاموش (فایل داده‌ی شخصی کاربران را دارد)
+UPDATE_CAPTURE_PATH = os.getenv("UPDATE_CAPTURE_PATH", "")
+
+
+def chat_key(update) -> int:
+    """کلید ترتیب: آپدیت‌های یک چت همیشه به یک worker می‌روند"""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
+
+
+class UpdatePool:
+    """وبهوک فوراً جواب می‌دهد و آپدیت‌ها در این workerها به Dispatcher داده می‌شوند"""
+
+    def __init__(self, dp, bot, workers: int = UPDATE_WORKERS, maxsize: int = UPDATE_QUEUE_SIZE):
+        self.dp = dp
+        self.bot = bot
+        self.queues = [asyncio.Queue(maxsize=maxsize) for _ in range(workers)]
+        self._tasks = []
+
+    async def submit(self, update):
+        # اگر صف پر باشد همین‌جا منتظر می‌ماند (backpressure) و ترتیب چت حفظ می‌شود
+        await self.queues[chat_key(update) % len(self.queues)].put(update)
+
+    def start(self):
+        for n, queue in enumerate(self.queues):
+            self._tasks.append(asyncio.create_task(self._worker(n, queue)))
+        logger.info(f"Update pool started with {len(self.queues)} workers")
+
+    async def stop(self):
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), UPDATE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Update pool drain timed out - dropping pending updates")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    async def _worker(self, n: int, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            metrics.new_trace(f"u{update.update_id}")
+            try:
+                with metrics.update_dispatch_seconds.time(type=update.event_type):
+                    await self.dp.feed_update(bot=self.bot, update=update)
+            except Exception as e:
+                logger.error(f"Update {update.update_id} failed on worker {n}: {e}")
+            finally:
+                queue.task_done()
+
+
+class UpdateCapture:
+    """هر آپدیت خام وبهوک یک خط JSONL همراه زمان دریافت"""
+
+    def __init__(self, path: str = UPDATE_CAPTURE_PATH):
+        self.path = path
+        self._fd = None
+
+    def write(self, raw: dict):
+        if not self.path:
+            return
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        line = json.dumps({"received": time.time(), "update": raw}, ensure_ascii=False) + "\n"
+        # یک write با O_APPEND: خط‌های workerهای مختلف در هم نمی‌روند
+        os.write(self._fd, line.encode())
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def handler_name(data: dict) -> str:
+    handler = data.get("handler")
+    return getattr(getattr(handler, "callback", None), "__name__", "unknown")
+
+
+class HandlerTimer(BaseMiddleware):
+    """inner middleware: زمان هر handler با نام تابعش (cmd_start، admin_refresh، ...)"""
+
+    def __init__(self):
+        # bench/replay.py اینجا نمونه‌های خام را جمع می‌کند: on_timed(name, seconds, ok)
+        self.on_timed = None
+
+    def install(self, dp):
+        for name, observer in dp.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(self)
+
+    async def __call__(self, handler, event, data):
+        name = handler_name(data)
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await handler(event, data)
+            ok = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.handler_seconds.observe(elapsed, handler=name)
+            if self.on_timed is not None:
+                self.on_timed(name, elapsed, ok)
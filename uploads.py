@@ -0,0 +1,180 @@
+import os
+import base64
+import asyncio
+import hashlib
+import tempfile
+from multipart.multipart import MultipartParser, parse_options_header
+
+# --- تنظیمات آپلود ---
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_FIELD_BYTES = 4096
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class SpooledPhoto:
+    """عکس آپلودی: تا SPOOL_MEMORY_BYTES در حافظه، بعد در فایل موقت نام‌دار
+
+    فایل نام دارد تا process pool رندر خودش آن را از دیسک بخواند؛ عکس بزرگ هیچ‌وقت
+    یک‌جا در حافظه‌ی پروسه‌ی وب خوانده نمی‌شود.
+    """
+
+    def __init__(self, max_memory: int = SPOOL_MEMORY_BYTES):
+        self.max_memory = max_memory
+        self.size = 0
+        # هش همزمان با رسیدن تکه‌ها؛ کلید idempotency بعداً فایل را دوباره نمی‌خواند
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """عکسی که از قبل در حافظه است (مسیر base64) بدون نوشتن روی دیسک"""
+        photo = cls()
+        photo._buffer, photo.size = data, len(data)
+        photo._sha256 = None
+        return photo
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        self._sha256.update(data)
+        if self._file is None and self.size > self.max_memory:
+            self._file = tempfile.NamedTemporaryFile(prefix="void-upload-")
+            self._file.write(self._buffer)
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer += data
+
+    def source(self):
+        """ورودی render.prepare_photo: بایت‌های عکس کوچک یا مسیر فایل موقت"""
+        if self._file is None:
+            return self._buffer
+        self._file.flush()
+        return self._file.name
+
+    async def digest(self) -> str:
+        """sha256 عکس؛ عکس جریانی هنگام نوشتن هش شده و بایت‌های آماده در thread هش می‌شوند"""
+        if self._sha256 is None:
+            self._sha256 = await asyncio.to_thread(hashlib.sha256, self._buffer)
+        return self._sha256.hexdigest()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def read_mint_form(request, max_bytes: int = MAX_UPLOAD_BYTES):
+    """خواندن جریانی فرم multipart؛ فیلدهای متنی و عکس (SpooledPhoto یا None)
+
+    عکس تکه به تکه در فایل موقت نوشته می‌شود و هیچ‌وقت کل بدنه در حافظه نگه داشته نمی‌شود.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected multipart/form-data", 415)
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes + MAX_FIELD_BYTES * 4:
+        raise UploadError("Photo too large", 413)
+
+    fields = {}
+    photo = None
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part["headers"] = {}
+        part["field"] = b""
+        part["value"] = b""
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = b""
+        part["value"] = b""
+
+    def on_headers_finished():
+        nonlocal photo
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode()
+        part["size"] = 0
+        if b"filename" in options:
+            if photo is not None:
+                raise UploadError("Only one photo allowed")
+            photo = part["file"] = SpooledPhoto()
+        else:
+            part["data"] = bytearray()
+
+    def on_part_data(data, start, end):
+        part["size"] += end - start
+        if "file" in part:
+            if part["size"] > max_bytes:
+                raise UploadError("Photo too large", 413)
+            part["file"].write(data[start:end])
+        else:
+            if part["size"] > MAX_FIELD_BYTES:
+                raise UploadError(f"Field {part['name']} too large", 413)
+            part["data"] += data[start:end]
+
+    def on_part_end():
+        if "file" not in part:
+            fields[part["name"]] = part["data"].decode("utf-8", errors="replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except UploadError:
+        if photo is not None:
+            photo.close()
+        raise
+    except Exception:
+        if photo is not None:
+            photo.close()
+        raise UploadError("Malformed upload")
+
+    # فایل خالی (انتخاب نشده) یعنی بدون عکس
+    if photo is not None and photo.size == 0:
+        photo.close()
+        photo = None
+    return fields, photo
+
+
+def decode_base64_photo(value: str) -> bytes:
+    """مسیر قدیمی JSON: رشته‌ی base64 یا data URL عکس"""
+    if "," in value[:100] and value.startswith("data:"):
+        value = value.split(",", 1)[1]
+    if len(value) > MAX_UPLOAD_BYTES * 4 // 3 + 4:
+        raise UploadError("Photo too large", 413)
+    try:
+        return base64.b64decode(value, validate=True)
+    except Exception:
+        raise UploadError("Invalid photo")
@@ -0,0 +1,100 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+import metrics
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- تنظیمات کش کاربران شناخته‌شده ---
+KNOWN_USERS_CACHE = int(os.getenv("KNOWN_USERS_CACHE", "100000"))
+# کاربرهای تازه حداکثر این‌قدر صبر می‌کنند تا با بقیه در یک نوشتن ثبت شوند
+USER_INSERT_WINDOW = float(os.getenv("USER_INSERT_WINDOW", "0.05"))
+USER_INSERT_BATCH = int(os.getenv("USER_INSERT_BATCH", "500"))
+
+
+def referrer_id(payload: str, user_id: int):
+    """payload لینک دعوت (?start=<id>)؛ دعوت از خود یا payload نامعتبر None"""
+    if not payload or not payload.isdigit():
+        return None
+    referrer = int(payload)
+    return referrer if referrer != user_id else None
+
+
+class KnownUsers:
+    """LRU شناسه‌ی کاربرهای موجود جلوی دیتابیس؛ /start تکراری هیچ کوئری‌ای نمی‌زند
+
+    کاربر تازه همان لحظه شناخته‌شده حساب می‌شود و در دسته‌ی بعدی insert ثبت می‌شود.
+    """
+
+    def __init__(self, size: int = KNOWN_USERS_CACHE):
+        self.size = size
+        self.ids = OrderedDict()
+        self.pending = {}
+        self._flush_task = None
+        self._flushes = set()
+        self._lock = asyncio.Lock()
+
+    async def warm(self):
+        for user_id in reversed(await db.user_ids(self.size)):
+            self.ids[user_id] = None
+        logger.info(f"Known-user cache warmed with {len(self.ids)} users")
+
+    def ensure(self, user_id: int, username: str, referrer: int = None) -> bool:
+        """True اگر کاربر تازه بود و در صف insert رفت"""
+        if user_id in self.ids:
+            self.ids.move_to_end(user_id)
+            metrics.known_user_lookups.inc(result="hit")
+            return False
+        metrics.known_user_lookups.inc(result="miss")
+        self._remember(user_id)
+        # اگر کاربر از قبل در دیتابیس باشد INSERT OR IGNORE کاری نمی‌کند و referrer هم امتیازی نمی‌گیرد
+        self.pending[user_id] = (user_id, username, referrer)
+        if len(self.pending) >= USER_INSERT_BATCH:
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return True
+
+    async def flush(self):
+        # پشت قفل: وقتی flush برگردد دسته‌ی در حال نوشتن قبلی هم commit شده است
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = list(self.pending.values()), {}
+            try:
+                added = await db.insert_users(batch)
+            except Exception as e:
+                logger.error(f"Failed to insert {len(batch)} new users: {e}")
+                # /start بعدی دوباره از اول تلاش می‌کند
+                for user_id, _, _ in batch:
+                    self.ids.pop(user_id, None)
+                return
+            if added:
+                logger.info(f"Registered {added} new users")
+
+    async def settle(self, user_id: int):
+        """قبل از کاری که سطر کاربر را لازم دارد (مثل مینت رایگان) insert در صف انجام می‌شود"""
+        if user_id in self.pending or self._lock.locked():
+            await self.flush()
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(USER_INSERT_WINDOW)
+            await self.flush()
+        finally:
+            self._flush_task = None
+
+    def _remember(self, user_id: int):
+        self.ids[user_id] = None
+        if len(self.ids) > self.size:
+            self.ids.popitem(last=False)